@@ -5,11 +5,12 @@ import warnings
 import time
 import math
 import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 from torch.optim import lr_scheduler
 from sklearn.metrics import roc_auc_score, classification_report, confusion_matrix, average_precision_score
 from model import MaskedAutoencoder
 from positional_encodings.torch_encodings import PositionalEncoding1D, PositionalEncoding2D
-from utils.utils import get_1d_sincos_pos_embed
+from utils.utils import get_1d_sincos_pos_embed, get_2d_pos_embed
 from tqdm import tqdm
 
 warnings.filterwarnings("ignore")
@@ -39,6 +40,7 @@ parser.add_argument('--decoder_depth', type=int, default=2, help='number of deco
 parser.add_argument('--decoder_num_heads', type=int, default=4, help='number of decoder multi-attention heads')
 parser.add_argument('--decoder_embed_dim', type=int, default=32, help='decoder embedding dimension in the feature space')
 parser.add_argument('--mlp_ratio', type=int, default=4, help='mlp ratio for vision transformer')
+parser.add_argument('--grad_checkpoint', type=str, default='False', help='recompute the activations of each encoder/decoder block in backward instead of storing them, less memory for more compute')
 # parser.add_argument('--finetune_checkpoints_dir', type=str, default='./finetune_checkpoints')
 parser.add_argument('--trial', type=int, default=0)
 parser.add_argument('--task_name', type=str, default='finetune')
@@ -99,7 +101,6 @@ class ModelPlugins():
         self.num_feats = num_feats
         
         # self.pos_embed = nn.Parameter(torch.zeros(1, self.window_len + 1, self.enc_embed_dim), requires_grad=False).to(self.device)
-        self.pos_embed = PositionalEncoding2D(enc_embed_dim).to(self.device)
         
         self.decoder_pos_embed = nn.Parameter(torch.zeros(1, self.window_len + 1, self.dec_embed_dim), requires_grad=False).to(self.device)
         # self.decoder_pos_embed = PositionalEncoding2D(dec_embed_dim).to(self.device)
@@ -108,8 +109,7 @@ class ModelPlugins():
     
     def initialize_embeddings(self):
         
-        enc_z = torch.rand((1, self.window_len + 1, self.num_feats, self.enc_embed_dim)).to(self.device) # +1 for the cls token
-        self.pos_embed = self.pos_embed(enc_z)
+        self.pos_embed = get_2d_pos_embed(self.window_len + 1, self.num_feats, self.enc_embed_dim, self.device) # +1 for the cls token
         
 #         pos_embed = get_1d_sincos_pos_embed(self.pos_embed.shape[-1], self.window_len, cls_token=True)
 #         self.pos_embed.data.copy_(torch.from_numpy(pos_embed).float().unsqueeze(0))
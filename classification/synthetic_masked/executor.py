@@ -1,6 +1,8 @@
+import os
 import sys
 sys.path.insert(1, './utils/')
 sys.path.append('../')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 
 import warnings
 import argparse
@@ -76,6 +78,7 @@ parser.add_argument('--decoder_depth', type=int, default=2, help='number of deco
 parser.add_argument('--decoder_num_heads', type=int, default=4, help='number of decoder multi-attention heads')
 parser.add_argument('--decoder_embed_dim', type=int, default=32, help='decoder embedding dimension in the feature space')
 parser.add_argument('--mlp_ratio', type=int, default=4, help='mlp ratio for vision transformer')
+parser.add_argument('--grad_checkpoint', type=str, default='False', help='recompute the activations of each encoder/decoder block in backward instead of storing them, less memory for more compute')
 
 # training 
 parser.add_argument('--batch_size', type=int, default=32)
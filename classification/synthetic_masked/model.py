@@ -16,7 +16,7 @@ from functools import partial
 from torch.optim import lr_scheduler
 from timm.models.vision_transformer import Block
 from positional_encodings.torch_encodings import PositionalEncoding1D, PositionalEncoding2D
-from utils import FeatEmbed
+from utils import FeatEmbed, apply_blocks, single_query_attention
 
 
 
@@ -40,6 +40,9 @@ class MaskedAutoencoder(nn.Module):
     Masked Autoencoder with Transformer backbone
     """
     
+    # models pickled before the option was added
+    grad_checkpoint = False
+    
     def __init__(self,
                  args,
                  num_feats,
@@ -69,6 +72,7 @@ class MaskedAutoencoder(nn.Module):
         self.mask_ratio = args.mask_ratio
         self.dropout = args.dropout
         self.task_name = args.task_name
+        self.grad_checkpoint = args.grad_checkpoint=='True'
         self.seq_len = args.seq_len
         
         self.data_config = data_config
@@ -125,9 +129,12 @@ class MaskedAutoencoder(nn.Module):
         # initialize patch_embed like nn.Linear (instead of nn.Conv2d)
         # w = self.mask_embed.proj.weight.data
         # torch.nn.init.xavier_uniform_(w.view([w.shape[0], -1]))
-        w = [self.mask_embed.embeddings[i][0].weight.data for i in range(self.num_feats)]
+        w = self.mask_embed.weight.data
         for i in range(self.num_feats):
-            torch.nn.init.xavier_uniform_(w[i].view([w[i].shape[0], -1]))
+            torch.nn.init.xavier_uniform_(w[i].view([w.shape[1], -1]))
+        nn.init.constant_(self.mask_embed.bias, 0)
+        nn.init.constant_(self.mask_embed.norm_weight, 1.0)
+        nn.init.constant_(self.mask_embed.norm_bias, 0)
 
         # timm's trunc_normal_(std=.02) is effectively normal_(std=0.02) as cutoff is too big (2.)
         torch.nn.init.normal_(self.cls_token, std=.02)
@@ -235,16 +242,7 @@ class MaskedAutoencoder(nn.Module):
 
     def cross_attention(self, x, m):
         
-        batch_size, window_size, num_feat, d = x.shape
-        var_query = self.var_query.repeat_interleave(batch_size*window_size, dim=0)
-        
-        x = x.view(-1, num_feat, d)
-        
-        m_ = copy.deepcopy(m.view(-1, num_feat))
-        
-        attn_out, _ = self.mhca(var_query, x, x, key_padding_mask=m_)
-        
-        attn_out = attn_out.view(batch_size, window_size, d)
+        attn_out = single_query_attention(self.var_query, x, self.mhca, key_padding_mask=m)
         
         return attn_out
     
@@ -284,8 +282,7 @@ class MaskedAutoencoder(nn.Module):
         x = torch.cat((cls_tokens, x), dim=1)
         
         # apply Transformer blocks
-        for blk in self.encoder_blocks:
-            x = blk(x)
+        x = apply_blocks(self.encoder_blocks, x, self.grad_checkpoint)
         x = self.norm(x)
         
         if self.task_name=='pretrain':
@@ -310,8 +307,7 @@ class MaskedAutoencoder(nn.Module):
         x = x + self.mpl.decoder_pos_embed
 
         # apply Transformer blocks
-        for blk in self.decoder_blocks:
-            x = blk(x)
+        x = apply_blocks(self.decoder_blocks, x, self.grad_checkpoint)
         x = self.decoder_norm(x)
         
         # predictor projection
@@ -21,7 +21,7 @@ from torch.utils.data import DataLoader, RandomSampler
 from torch.optim import lr_scheduler
 import torch.nn.functional as F
 from timm.models.vision_transformer import Block
-from utils import MaskEmbed, MAEDataset_PT, MAEDataset_FT, NativeScaler, get_1d_sincos_pos_embed, ActiveEmbed, FeatEmbed, adjust_learning_rate, cal_classification_metrics, get_class_weights
+from utils import MaskEmbed, MAEDataset_PT, MAEDataset_FT, NativeScaler, get_1d_sincos_pos_embed, get_2d_pos_embed, ActiveEmbed, FeatEmbed, adjust_learning_rate, cal_classification_metrics, get_class_weights
 from positional_encodings.torch_encodings import PositionalEncoding1D, PositionalEncoding2D
 from tools import EarlyStopping, adjust_learning_rate, transfer_weights
 
@@ -58,7 +58,6 @@ class ModelPlugins():
         self.num_feats = num_feats
         
         # self.pos_embed = nn.Parameter(torch.zeros(1, self.window_len + 1, self.enc_embed_dim), requires_grad=False).to(self.device)
-        self.pos_embed = PositionalEncoding2D(enc_embed_dim).to(self.device)
         
         self.decoder_pos_embed = nn.Parameter(torch.zeros(1, self.window_len + 1, self.dec_embed_dim), requires_grad=False).to(self.device)
         # self.decoder_pos_embed = PositionalEncoding2D(dec_embed_dim).to(self.device)
@@ -67,8 +66,7 @@ class ModelPlugins():
     
     def initialize_embeddings(self):
         
-        enc_z = torch.rand((1, self.window_len + 1, self.num_feats, self.enc_embed_dim)).to(self.device) # +1 for the cls token
-        self.pos_embed = self.pos_embed(enc_z)
+        self.pos_embed = get_2d_pos_embed(self.window_len + 1, self.num_feats, self.enc_embed_dim, self.device) # +1 for the cls token
         
 #         pos_embed = get_1d_sincos_pos_embed(self.pos_embed.shape[-1], self.window_len, cls_token=True)
 #         self.pos_embed.data.copy_(torch.from_numpy(pos_embed).float().unsqueeze(0))
@@ -129,8 +127,7 @@ class Trainer():
     
     def get_data(self, X, Y, split_flag):
         
-        M = 1 - (1 * (torch.isnan(X)))
-        M = M.float()
+        M = ~torch.isnan(X)
         
         X = torch.nan_to_num(X)
         
@@ -160,8 +157,7 @@ class Trainer():
         self.model.eval()
         for iteration, (X, Y) in enumerate(dataloader):
             
-            mask_original = 1 - (1 * (torch.isnan(X)))
-            mask_original = mask_original.float().to(self.device)
+            mask_original = (~torch.isnan(X)).to(self.device).float()
             X = torch.nan_to_num(X).float().to(self.device)
 
             pred, mask, nask = self.model(X, mask_original, self.mpl)
@@ -210,8 +206,7 @@ class Trainer():
         self.model.train()
         for iteration, (X, Y) in enumerate(dataloader):
             
-            mask_original = 1 - (1 * (torch.isnan(X)))
-            mask_original = mask_original.float().to(self.device)
+            mask_original = (~torch.isnan(X)).to(self.device).float()
             X = torch.nan_to_num(X).float().to(self.device)
             # print(f"shape of X = {X.shape}")
             pred, mask, nask = self.model(X, mask_original, self.mpl)
@@ -400,8 +395,7 @@ class Trainer():
                 self.model.train()
                 for iteration, (X, labels) in enumerate(train_loader):
                     
-                    mask_original = 1 - (1 * (torch.isnan(X)))
-                    mask_original = mask_original.float().to(self.device)
+                    mask_original = (~torch.isnan(X)).to(self.device).float()
                     X = torch.nan_to_num(X).float().to(self.device)
                     labels = labels.long().to(self.device)
 
@@ -493,8 +487,7 @@ class Trainer():
         with torch.no_grad():
             for i, (batch_x, labels) in enumerate(vali_loader):
                 
-                mask_original = 1 - (1 * (torch.isnan(batch_x)))
-                mask_original = mask_original.float().to(self.device)
+                mask_original = (~torch.isnan(batch_x)).to(self.device).float()
                 batch_x = torch.nan_to_num(batch_x).float().to(self.device)
                 labels = labels.long().to(self.device)
 
@@ -575,8 +568,7 @@ class Trainer():
             
             for i, (data, labels) in enumerate(test_loader):
                 
-                mask_original = 1 - (1 * (torch.isnan(data)))
-                mask_original = mask_original.float().to(self.device)
+                mask_original = (~torch.isnan(data)).to(self.device).float()
                 data = torch.nan_to_num(data).float().to(self.device)
                 labels = labels.long().to(self.device)
                 
@@ -12,6 +12,8 @@ from torch import nn as nn
 from torch.utils.data import Dataset, DataLoader
 from tqdm import tqdm
 
+from misstsm import TFI as FeatEmbed, apply_blocks, get_2d_pos_embed, single_query_attention
+
 def count_labels(dataloader):
     label_counts = {0: 0, 1: 0}  # Initialize count for each label
 
@@ -123,26 +125,6 @@ class MaskEmbed(nn.Module):
         x = self.norm(x)
         return x
 
-class FeatEmbed(nn.Module):
-    """
-    Embed each feature
-    """
-    def __init__(self, input_dim=8, embedding_dim=8, norm_layer=None):
-        super().__init__()
-        self.embeddings = nn.ModuleList([
-            nn.Sequential(
-                nn.Linear(1, embedding_dim),
-                nn.LayerNorm(embedding_dim)
-            )
-            for _ in range(input_dim)
-        ])
-
-    def forward(self, x):
-        # print(f"x shape = {x.shape}")
-        embedded_features = [emb_layer(x[:, :, i].unsqueeze(-1)) for i, emb_layer in enumerate(self.embeddings)]
-        embedded_features = torch.stack(embedded_features, dim=2)
-        return embedded_features
-
 class ActiveEmbed(nn.Module):
     """ 
     record to mask embedding
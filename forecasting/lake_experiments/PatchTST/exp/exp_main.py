@@ -62,8 +62,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -156,8 +156,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
                 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -286,8 +286,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -428,8 +428,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -482,7 +482,7 @@ class Exp_Main(Exp_Basic):
                 
                 trues.append(true)
 
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_y = batch_mask_y.to(self.device).float()
                 batch_mask_y = batch_mask_y[:, -self.args.pred_len:, f_dim:].to(self.device)
                 batch_mask_y = batch_mask_y.detach().cpu().numpy()
                 mask_y = batch_mask_y
@@ -1,5 +1,7 @@
 import argparse
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..'))
 import torch
 from exp.exp_main import Exp_Main
 import random
@@ -4,7 +4,7 @@ import pandas as pd
 import torch
 from torch.utils.data import Dataset, DataLoader
 from sklearn.preprocessing import StandardScaler
-from utils.timefeatures import time_features
+from misstsm.timefeatures import time_features, calendar_features
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -65,17 +65,16 @@ class Dataset_ETT_hour(Dataset):
         df_stamp = df_raw[['date']][border1:border2]
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], 1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
+        # zero-filled values and observed-value mask, computed once per split
+        self.data_x = np.nan_to_num(data[border1:border2])
+        self.data_y = self.data_x
+        self.mask_x = ~np.isnan(data[border1:border2])
+        self.mask_y = self.mask_x
         self.data_stamp = data_stamp
 
     def __getitem__(self, index):
@@ -88,15 +87,8 @@ class Dataset_ETT_hour(Dataset):
         seq_y = self.data_y[r_begin:r_end]
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-        
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
@@ -162,19 +154,16 @@ class Dataset_ETT_minute(Dataset):
         df_stamp = df_raw[['date']][border1:border2]
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], 1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour', 'minute'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
+        # zero-filled values and observed-value mask, computed once per split
+        self.data_x = np.nan_to_num(data[border1:border2])
+        self.data_y = self.data_x
+        self.mask_x = ~np.isnan(data[border1:border2])
+        self.mask_y = self.mask_x
         self.data_stamp = data_stamp
 
     def __getitem__(self, index):
@@ -187,15 +176,8 @@ class Dataset_ETT_minute(Dataset):
         seq_y = self.data_y[r_begin:r_end]
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
@@ -271,17 +253,16 @@ class Dataset_Custom(Dataset):
         df_stamp = df_raw[['date']][border1:border2]
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], 1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
+        # zero-filled values and observed-value mask, computed once per split
+        self.data_x = np.nan_to_num(data[border1:border2])
+        self.data_y = self.data_x
+        self.mask_x = ~np.isnan(data[border1:border2])
+        self.mask_y = self.mask_x
         self.data_stamp = data_stamp
 
     def __getitem__(self, index):
@@ -294,15 +275,8 @@ class Dataset_Custom(Dataset):
         seq_y = self.data_y[r_begin:r_end]
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
@@ -524,13 +498,7 @@ class Dataset_Pred(Dataset):
         df_stamp = pd.DataFrame(columns=['date'])
         df_stamp.date = list(tmp_stamp.date.values) + list(pred_dates[1:])
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], 1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour', 'minute'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
@@ -636,18 +604,16 @@ class Dataset_Lake(Dataset):
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         
         if self.timeenc == 0:
-            df_stamp['year'] = df_stamp.date.apply(lambda row: row.year, 1)
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            # df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], axis=1).values
+            data_stamp = calendar_features(df_stamp.date, ('year', 'month', 'day', 'weekday'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
+        # zero-filled values and observed-value mask, computed once per split
+        self.data_x = np.nan_to_num(data[border1:border2])
+        self.data_y = self.data_x
+        self.mask_x = ~np.isnan(data[border1:border2])
+        self.mask_y = self.mask_x
         self.data_stamp = data_stamp
 
     def __getitem__(self, index):
@@ -660,15 +626,8 @@ class Dataset_Lake(Dataset):
         seq_y = self.data_y[r_begin:r_end]
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
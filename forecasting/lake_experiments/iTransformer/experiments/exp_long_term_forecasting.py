@@ -51,8 +51,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -131,8 +131,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
                 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -253,8 +253,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -373,8 +373,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -425,7 +425,7 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                 
                 trues.append(true)
                 
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_y = batch_mask_y.to(self.device).float()
                 batch_mask_y = batch_mask_y[:, -self.args.pred_len:, f_dim:].to(self.device)
                 batch_mask_y = batch_mask_y.detach().cpu().numpy()
                 mask_y = batch_mask_y
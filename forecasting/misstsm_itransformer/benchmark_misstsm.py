@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from layers.Transformer_EncDec import MissTSM, MissTSMSkip, iMissTSM
+
+
+def build_layer(args, num_queries, kv_groups):
+    kwargs = dict(q_dim=args.q_dim,
+                  num_feats=args.enc_in,
+                  num_heads=args.n_heads,
+                  embed=args.embed_type,
+                  mtsm_norm=args.mtsm_norm,
+                  num_queries=num_queries,
+                  kv_groups=kv_groups)
+    if args.layer == 'inverted':
+        return iMissTSM(seq_len=args.seq_len, **kwargs)
+    if args.layer == 'skip':
+        return MissTSMSkip(**kwargs)
+    return MissTSM(**kwargs)
+
+
+def benchmark(layer, x, m, train, iters, warmup):
+    layer.train(train)
+    for i in range(warmup + iters):
+        if i == warmup:
+            start = time.perf_counter()
+        if train:
+            layer.zero_grad()
+            layer(x, m).pow(2).mean().backward()
+        else:
+            with torch.no_grad():
+                layer(x, m)
+    return (time.perf_counter() - start) / iters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MissTSM throughput vs. number of queries and key/value groups')
+    parser.add_argument('--layer', type=str, default='plain', help='options: [plain, skip, inverted]')
+    parser.add_argument('--batch_size', type=int, default=32, help='batch size')
+    parser.add_argument('--seq_len', type=int, default=96, help='input sequence length')
+    parser.add_argument('--enc_in', type=int, default=21, help='number of features')
+    parser.add_argument('--q_dim', type=int, default=16, help='query dimension')
+    parser.add_argument('--n_heads', type=int, default=4, help='number of query heads')
+    parser.add_argument('--embed_type', type=str, default='tfi', help='type of TFI embedding to apply')
+    parser.add_argument('--mtsm_norm', type=int, default=1, help='perform denorm misstsm')
+    parser.add_argument('--mask_rate', type=float, default=0.5, help='fraction of missing values')
+    parser.add_argument('--queries', type=str, default='1,2,4,8', help='comma separated numbers of queries')
+    parser.add_argument('--kv_groups', type=str, default='1,2,4', help='comma separated numbers of key/value groups')
+    parser.add_argument('--iters', type=int, default=20, help='timed iterations')
+    parser.add_argument('--warmup', type=int, default=3, help='untimed iterations')
+    parser.add_argument('--use_gpu', type=int, default=1, help='use gpu if available')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if args.use_gpu and torch.cuda.is_available() else 'cpu')
+    torch.manual_seed(0)
+    m = (torch.rand(args.batch_size, args.seq_len, args.enc_in) > args.mask_rate).float()
+    m[:, :, 0] = 1
+    x = torch.randn(args.batch_size, args.seq_len, args.enc_in) * m
+    x, m = x.to(device), m.to(device)
+
+    # nn.MultiheadAttention with a single query is the baseline
+    configs = [(1, None)]
+    for num_queries in [int(q) for q in args.queries.split(',')]:
+        for kv_groups in [int(g) for g in args.kv_groups.split(',')]:
+            if args.n_heads % kv_groups == 0:
+                configs.append((num_queries, kv_groups))
+
+    print('{:>8} {:>10} {:>10} {:>14} {:>14}'.format('queries', 'kv_groups', 'params', 'infer win/s', 'train win/s'))
+    for num_queries, kv_groups in configs:
+        layer = build_layer(args, num_queries, kv_groups).to(device)
+        params = sum(p.numel() for p in layer.parameters())
+        infer = benchmark(layer, x, m, False, args.iters, args.warmup)
+        train = benchmark(layer, x, m, True, args.iters, args.warmup)
+        print('{:>8} {:>10} {:>10} {:>14.0f} {:>14.0f}'.format(
+            num_queries, kv_groups or 'mha', params, args.batch_size / infer, args.batch_size / train))
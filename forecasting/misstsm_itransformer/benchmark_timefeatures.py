@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from misstsm.timefeatures import calendar_features, time_features, time_features_from_frequency_str
+
+
+def rowwise_calendar_features(dates, names):
+    # the former timeenc=0 encoding, one python call per row and column
+    df_stamp = pd.DataFrame({'date': dates})
+    for name in names:
+        if name == 'weekday':
+            df_stamp[name] = df_stamp.date.apply(lambda row: row.weekday())
+        else:
+            df_stamp[name] = df_stamp.date.apply(lambda row: getattr(row, name))
+    if 'minute' in names:
+        df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
+    return df_stamp.drop(['date'], axis=1).values
+
+
+def accessor_time_features(dates, freq):
+    # the former timeenc=1 encoding, one DatetimeIndex accessor per feature
+    index = pd.DatetimeIndex(dates)
+    fields = {'second': index.second, 'minute': index.minute, 'hour': index.hour, 'dayofweek': index.dayofweek,
+              'day': index.day, 'dayofyear': index.dayofyear, 'month': index.month,
+              'week': index.isocalendar().week}
+    return np.vstack([feat.encode(fields[feat.field]) for feat in time_features_from_frequency_str(freq)])
+
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='time feature encodings: row-wise / accessor vs. vectorized')
+    parser.add_argument('--root_path', type=str, default='', help='root path of the data file, empty for generated dates')
+    parser.add_argument('--data_path', type=str, default='ETTm1.csv', help='data csv file with a date column')
+    parser.add_argument('--rows', type=int, default=69680, help='number of generated dates (ETTm length)')
+    parser.add_argument('--freq', type=str, default='15min', help='freq of the generated dates and of the timeenc=1 features')
+    parser.add_argument('--repeat', type=int, default=3, help='timed repetitions, the best is reported')
+    args = parser.parse_args()
+
+    if args.root_path:
+        raw_dates = pd.read_csv(os.path.join(args.root_path, args.data_path), usecols=['date'])['date']
+    else:
+        raw_dates = pd.Series(pd.date_range('2016-07-01', periods=args.rows, freq=args.freq).astype(str))
+    parse_time, dates = timed(lambda: pd.to_datetime(raw_dates), args.repeat)
+    print('{} dates, pd.to_datetime {:.3f}s'.format(len(dates), parse_time))
+
+    names = ('month', 'day', 'weekday', 'hour', 'minute')
+    runs = [('timeenc=0', lambda: rowwise_calendar_features(dates, names), lambda: calendar_features(dates, names)),
+            ('timeenc=1', lambda: accessor_time_features(dates, args.freq), lambda: time_features(dates, args.freq))]
+
+    print('{:>10} {:>12} {:>12} {:>9} {:>10}'.format('encoding', 'before (s)', 'after (s)', 'speedup', 'identical'))
+    for name, before, after in runs:
+        before_time, expected = timed(before, args.repeat)
+        after_time, out = timed(after, args.repeat)
+        identical = np.array_equal(expected, out)
+        print('{:>10} {:>12.4f} {:>12.4f} {:>8.1f}x {:>10}'.format(
+            name, before_time, after_time, before_time / after_time, str(identical)))
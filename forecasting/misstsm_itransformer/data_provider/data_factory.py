@@ -1,6 +1,7 @@
 from data_provider.data_loader import Dataset_ETT_hour, Dataset_ETT_minute, Dataset_Custom, Dataset_Solar, Dataset_PEMS, \
     Dataset_Pred
-from torch.utils.data import DataLoader
+from data_provider.data_loader import BatchedWindows, MaskedGroundTruth
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler, SequentialSampler
 
 data_dict = {
     'ETTh1': Dataset_ETT_hour,
@@ -15,7 +16,7 @@ data_dict = {
 }
 
 
-def data_provider(args, flag, gt=None):
+def build_dataset(args, flag, gt=None):
     Data = data_dict[args.data]
     timeenc = 0 if args.embed != 'timeF' else 1
 
@@ -43,6 +44,12 @@ def data_provider(args, flag, gt=None):
         root_path=args.root_path
         data_path=args.data_path
         
+    # datasets that parse a data file, read through the on-disk dataset cache
+    cache_kwargs = {}
+    if Data in (Dataset_ETT_hour, Dataset_ETT_minute, Dataset_Custom):
+        cache_kwargs['cache_dir'] = getattr(args, 'data_cache_dir', '')
+        cache_kwargs['chunk_rows'] = getattr(args, 'stream_chunk_rows', 0)
+        cache_kwargs['storage_dtype'] = getattr(args, 'storage_dtype', 'float32')
     data_set = Data(
         root_path=root_path,
         data_path=data_path,
@@ -52,12 +59,46 @@ def data_provider(args, flag, gt=None):
         target=args.target,
         timeenc=timeenc,
         freq=freq,
+        **cache_kwargs
     )
     print(flag, len(data_set))
-    data_loader = DataLoader(
+    return data_set, shuffle_flag, drop_last, batch_size
+
+
+def build_loader(args, data_set, shuffle_flag, drop_last, batch_size, gt_set=None):
+    if getattr(args, 'batch_windows', 0) and hasattr(data_set, 'mask_x'):
+        # gather whole batches at once, same batches and order as the per-window loader
+        sampler = RandomSampler(data_set) if shuffle_flag else SequentialSampler(data_set)
+        windows = BatchedWindows(data_set)
+        if gt_set is not None:
+            windows = MaskedGroundTruth(windows, BatchedWindows(gt_set))
+        return DataLoader(
+            windows,
+            sampler=BatchSampler(sampler, batch_size, drop_last),
+            batch_size=None,
+            num_workers=args.num_workers)
+    if gt_set is not None:
+        data_set = MaskedGroundTruth(data_set, gt_set)
+    return DataLoader(
         data_set,
         batch_size=batch_size,
         shuffle=shuffle_flag,
         num_workers=args.num_workers,
         drop_last=drop_last)
+
+
+def data_provider(args, flag, gt=None):
+    data_set, shuffle_flag, drop_last, batch_size = build_dataset(args, flag, gt)
+    data_loader = build_loader(args, data_set, shuffle_flag, drop_last, batch_size)
     return data_set, data_loader
+
+
+def masked_gt_provider(args, flag='test'):
+    """
+    One loader over the masked data and the ground-truth file (gt_root_path / gt_data_path): each
+    batch is the data_provider batch followed by the ground-truth x and y of the same windows
+    """
+    data_set, shuffle_flag, drop_last, batch_size = build_dataset(args, flag)
+    gt_set = build_dataset(args, flag, gt=True)[0]
+    data_loader = build_loader(args, data_set, shuffle_flag, drop_last, batch_size, gt_set=gt_set)
+    return data_set, gt_set, data_loader
@@ -1,4 +1,4 @@
-from data_provider.data_factory import data_provider
+from data_provider.data_factory import data_provider, masked_gt_provider
 from experiments.exp_basic import Exp_Basic
 from utils.tools import EarlyStopping, adjust_learning_rate, visual
 from utils.metrics import metric
@@ -29,6 +29,10 @@ class Exp_Long_Term_Forecast(Exp_Basic):
         data_set, data_loader = data_provider(self.args, flag, gt)
         return data_set, data_loader
 
+    def _get_masked_gt_data(self, flag):
+        data_set, gt_set, data_loader = masked_gt_provider(self.args, flag)
+        return data_set, gt_set, data_loader
+
     def _select_optimizer(self):
         model_optim = optim.Adam(self.model.parameters(), lr=self.args.learning_rate)
         return model_optim
@@ -51,8 +55,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -131,8 +135,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
                 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -233,6 +237,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
             os.makedirs(folder_path)
             
         self.model.eval()
+        if self.args.mtsm_stream:
+            self.model.start_stream()
         with torch.no_grad():
             for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, batch_mask_x, batch_mask_y) in enumerate(test_loader):
                 batch_x = batch_x.float().to(self.device)
@@ -245,8 +251,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -304,6 +310,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     gt[full_mask == 0] = np.nan
 
                     visual(gt, pd, os.path.join(folder_path, str(i) + '.pdf'))
+        if self.args.mtsm_stream:
+            self.model.stop_stream()
 
         preds = np.array(preds)
         trues = np.array(trues)
@@ -331,8 +339,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
 
     
     def test_masked(self, setting, test=0):
-        test_data, test_loader = self._get_data(flag='test')
-        test_data_gt, test_loader_gt = self._get_data(flag='test', gt=True)
+        # masked inputs and ground-truth targets of the same windows in one pass
+        test_data, test_data_gt, test_loader = self._get_masked_gt_data(flag='test')
         
         if test:
             print('loading model')
@@ -353,8 +361,10 @@ class Exp_Long_Term_Forecast(Exp_Basic):
             os.makedirs(folder_path)
             
         self.model.eval()
+        if self.args.mtsm_stream:
+            self.model.start_stream()
         with torch.no_grad():
-            for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, batch_mask_x, batch_mask_y) in enumerate(test_loader):
+            for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, batch_mask_x, batch_mask_y, gt_x, gt_y) in enumerate(test_loader):
                 batch_x = batch_x.float().to(self.device)
                 batch_y = batch_y.float().to(self.device)
 
@@ -365,8 +375,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     batch_x_mark = batch_x_mark.float().to(self.device)
                     batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -408,17 +418,12 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                 preds.append(pred)
                 masks_y.append(mask_y)
                 masks_x.append(mask_x)
-            
-            for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, _, _) in enumerate(test_loader_gt):
-                
-                f_dim = -1 if self.args.features == 'MS' else 0
-                batch_y = batch_y[:, -self.args.pred_len:, f_dim:].to(self.device)
-                true = batch_y.detach().cpu().numpy()
-                
+
+                true = gt_y[:, -self.args.pred_len:, f_dim:].numpy()
                 trues.append(true)
                 
                 if i % 10 == 0:
-                    input = batch_x.detach().cpu().numpy()
+                    input = gt_x.numpy()
                     if test_data.scale and self.args.inverse:
                         shape = input.shape
                         input = test_data.inverse_transform(input.squeeze(0)).reshape(shape)
@@ -437,6 +442,8 @@ class Exp_Long_Term_Forecast(Exp_Basic):
                     visual(true=gt, 
                            preds=pd, 
                            name=os.path.join(folder_path, self.args.root_path.split('/')[-1] + "_" + str(self.args.pred_len) + "_" + str(i) + '.pdf'))
+        if self.args.mtsm_stream:
+            self.model.stop_stream()
 
         preds = np.array(preds)
         trues = np.array(trues)
@@ -22,6 +22,13 @@ class Model(nn.Module):
         self.layernorm = configs.layernorm
         self.inverted = configs.inverted
         self.skip_connection = configs.skip_connection
+        self.observed_only = configs.observed_only
+        self.mtsm_chunk_size = configs.mtsm_chunk_size
+        self.mtsm_checkpoint = configs.mtsm_checkpoint
+        self.mtsm_queries = configs.mtsm_queries
+        self.mtsm_kv_groups = configs.mtsm_kv_groups or None
+        self.mtsm_stream = configs.mtsm_stream
+        self.streaming = False
         
         # Embedding
         self.enc_embedding = DataEmbedding_inverted(configs.seq_len, configs.d_model, configs.embed, configs.freq,
@@ -51,6 +58,8 @@ class Model(nn.Module):
             print("\nApplying MissTSM layer\n")
             if not self.inverted:
                 if self.skip_connection:
+                    if self.mtsm_stream:
+                        raise ValueError("--mtsm_stream needs the MissTSM layer without --skip_connection")
                     self.MTSMLayer = MissTSMSkip(q_dim=configs.q_dim,
                                         k_dim=configs.k_dim,
                                         v_dim=configs.v_dim, 
@@ -58,7 +67,12 @@ class Model(nn.Module):
                                         norm=self.use_norm,
                                         embed=self.embed_type,
                                         mtsm_norm=self.mtsm_norm,
-                                        layernorm=self.layernorm
+                                        layernorm=self.layernorm,
+                                        observed_only=self.observed_only,
+                                        chunk_size=self.mtsm_chunk_size,
+                                        use_checkpoint=self.mtsm_checkpoint,
+                                        num_queries=self.mtsm_queries,
+                                        kv_groups=self.mtsm_kv_groups
                                      )
                 else:
                     self.MTSMLayer = MissTSM(q_dim=configs.q_dim,
@@ -68,9 +82,16 @@ class Model(nn.Module):
                                         norm=self.use_norm,
                                         embed=self.embed_type,
                                         mtsm_norm=self.mtsm_norm,
-                                        layernorm=self.layernorm
+                                        layernorm=self.layernorm,
+                                        observed_only=self.observed_only,
+                                        chunk_size=self.mtsm_chunk_size,
+                                        use_checkpoint=self.mtsm_checkpoint,
+                                        num_queries=self.mtsm_queries,
+                                        kv_groups=self.mtsm_kv_groups
                                         )
             else:
+                if self.mtsm_stream:
+                    raise ValueError("--mtsm_stream needs the MissTSM layer without --inverted")
                 print("\nApplying inverted MissTSM layer\n")
                 self.MTSMLayer = iMissTSM(q_dim=configs.q_dim,
                                      k_dim=configs.k_dim,
@@ -80,9 +101,39 @@ class Model(nn.Module):
                                      embed=self.embed_type,
                                      mtsm_norm=self.mtsm_norm,
                                      layernorm=self.layernorm,
-                                     seq_len=configs.seq_len
+                                     seq_len=configs.seq_len,
+                                     observed_only=self.observed_only,
+                                     chunk_size=self.mtsm_chunk_size,
+                                     use_checkpoint=self.mtsm_checkpoint,
+                                     num_queries=self.mtsm_queries,
+                                     kv_groups=self.mtsm_kv_groups
                                      )
 
+    def start_stream(self):
+        '''
+        Impute the following windows with MTSMLayer.stream, see stream_impute
+        '''
+        self.MTSMLayer.reset_stream(self.seq_len)
+        self.streaming = True
+        self.streamed = False
+
+    def stop_stream(self):
+        self.streaming = False
+
+    def stream_impute(self, x_enc, m):
+        '''
+        MTSMLayer output of consecutive windows (window b + 1 starts one timestep after window b, as
+        in the unshuffled test loader): the first window is streamed whole, then one timestep each
+        '''
+        outputs = []
+        for x, mask in zip(x_enc, m):
+            steps = [self.seq_len - 1] if self.streamed else range(self.seq_len)
+            for t in steps:
+                out = self.MTSMLayer.stream(x[t:t + 1], mask[t:t + 1])
+            self.streamed = True
+            outputs.append(out)
+        return torch.cat(outputs)
+
     def forecast(self, x_enc, x_mark_enc, m, x_dec, x_mark_dec):
         if self.use_norm:
             # Normalization from Non-stationary Transformer
@@ -122,7 +173,7 @@ class Model(nn.Module):
     def forward(self, x_enc, x_mark_enc, m, x_dec, x_mark_dec, mask=None):
         # apply misstsm - an external layer not part of the model backbone
         if self.misstsm:
-            x_enc = self.MTSMLayer(x_enc, m)
+            x_enc = self.stream_impute(x_enc, m) if self.streaming else self.MTSMLayer(x_enc, m)
             
         dec_out = self.forecast(x_enc, x_mark_enc, m, x_dec, x_mark_dec)
         return dec_out[:, -self.pred_len:, :]  # [B, L, D]
\ No newline at end of file
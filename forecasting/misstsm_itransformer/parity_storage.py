@@ -0,0 +1,87 @@
+"""
+Accuracy parity of reduced-precision series storage (--storage_dtype) against float32: per split the
+error of the stored values, the MSE / MAE of a last-value forecast computed on the loader batches,
+and the memory of the stored values.
+Run from this directory: python parity_storage.py --data ETTh1 --root_path ./dataset/ETT-small/ --data_path ETTh1.csv
+"""
+import argparse
+import copy
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from data_provider.data_factory import data_provider
+from misstsm.data_cache import from_storage
+
+
+def last_value_metrics(loader, pred_len):
+    # squared and absolute error of repeating the last input step, over the observed target cells
+    se, ae, count = 0., 0., 0.
+    for batch_x, batch_y, _, _, _, batch_mask_y in loader:
+        pred = batch_x[:, -1:, :].double()
+        true = batch_y[:, -pred_len:, :].double()
+        mask = batch_mask_y[:, -pred_len:, :].double()
+        se += float(((pred - true) ** 2 * mask).sum())
+        ae += float(((pred - true).abs() * mask).sum())
+        count += float(mask.sum())
+    return se / max(count, 1), ae / max(count, 1)
+
+
+def relative(a, b):
+    return abs(a - b) / max(abs(b), 1e-12)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='reduced-precision storage vs. float32 parity')
+    parser.add_argument('--data', type=str, default='ETTh1', help='dataset type')
+    parser.add_argument('--root_path', type=str, default='./data/ETT/', help='root path of the data file')
+    parser.add_argument('--data_path', type=str, default='ETTh1.csv', help='data file: csv, parquet or feather')
+    parser.add_argument('--features', type=str, default='M', help='forecasting task, options:[M, S, MS]')
+    parser.add_argument('--target', type=str, default='OT', help='target feature in S or MS task')
+    parser.add_argument('--freq', type=str, default='h', help='freq for time features encoding')
+    parser.add_argument('--embed', type=str, default='timeF', help='time features encoding, options:[timeF, fixed, learned]')
+    parser.add_argument('--seq_len', type=int, default=96, help='input sequence length')
+    parser.add_argument('--label_len', type=int, default=48, help='start token length')
+    parser.add_argument('--pred_len', type=int, default=96, help='prediction sequence length')
+    parser.add_argument('--batch_size', type=int, default=32, help='batch size of the loaders')
+    parser.add_argument('--num_workers', type=int, default=0, help='data loader num workers')
+    parser.add_argument('--batch_windows', type=int, default=1, help='gather whole batches of windows')
+    parser.add_argument('--data_cache_dir', type=str, default='', help='dataset cache directory, empty to parse in memory')
+    parser.add_argument('--storage_dtypes', type=str, nargs='+', default=['float16', 'bfloat16'],
+                        help='storage dtypes compared with float32')
+    parser.add_argument('--tol', type=float, default=1e-2, help='max relative difference of the metrics')
+    args = parser.parse_args()
+
+    def load(storage, flag):
+        run_args = copy.copy(args)
+        run_args.storage_dtype = storage
+        return data_provider(run_args, flag)
+
+    reference = {flag: load('float32', flag) for flag in ['train', 'val', 'test']}
+    failures = 0
+    print('{:<9} {:<6} {:>8} {:>10} {:>10} {:>10} {:>10}  {}'.format(
+        'storage', 'split', 'MB', 'max err', 'rel rmse', 'mse diff', 'mae diff', ''))
+    for storage in args.storage_dtypes:
+        for flag, (ref_set, ref_loader) in reference.items():
+            data_set, loader = load(storage, flag)
+            values = from_storage(np.asarray(data_set.data_x))
+            ref_values = np.asarray(ref_set.data_x)
+            max_err = float(np.abs(values - ref_values).max())
+            rel_rmse = float(np.sqrt(np.mean((values - ref_values) ** 2) / max(np.mean(ref_values ** 2), 1e-12)))
+
+            # the train loader shuffles and drops a batch, its metrics are not comparable
+            mse_diff = mae_diff = 0.
+            if flag != 'train':
+                mse, mae = last_value_metrics(loader, args.pred_len)
+                ref_mse, ref_mae = last_value_metrics(ref_loader, args.pred_len)
+                mse_diff, mae_diff = relative(mse, ref_mse), relative(mae, ref_mae)
+            ok = mse_diff <= args.tol and mae_diff <= args.tol and np.isfinite(values).all()
+            failures += not ok
+            print('{:<9} {:<6} {:>8.1f} {:>10.1e} {:>10.1e} {:>10.1e} {:>10.1e}  {}'.format(
+                storage, flag, data_set.data_x.nbytes / 2 ** 20, max_err, rel_rmse, mse_diff, mae_diff,
+                'ok' if ok else 'FAIL'))
+
+    print('{} failed'.format(failures) if failures else 'all passed')
+    sys.exit(1 if failures else 0)
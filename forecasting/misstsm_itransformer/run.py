@@ -1,4 +1,7 @@
 import argparse
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 import torch
 from experiments.exp_long_term_forecasting import Exp_Long_Term_Forecast
 from experiments.exp_long_term_forecasting_partial import Exp_Long_Term_Forecast_Partial
@@ -22,7 +25,7 @@ if __name__ == '__main__':
     # data loader
     parser.add_argument('--data', type=str, required=True, default='custom', help='dataset type')
     parser.add_argument('--root_path', type=str, default='./data/electricity/', help='root path of the data file')
-    parser.add_argument('--data_path', type=str, default='electricity.csv', help='data csv file')
+    parser.add_argument('--data_path', type=str, default='electricity.csv', help='data file: csv, parquet or feather')
     parser.add_argument('--features', type=str, default='M',
                         help='forecasting task, options:[M, S, MS]; M:multivariate predict multivariate, S:univariate predict univariate, MS:multivariate predict univariate')
     parser.add_argument('--target', type=str, default='OT', help='target feature in S or MS task')
@@ -70,9 +73,19 @@ if __name__ == '__main__':
     parser.add_argument('--mtsm_norm', type=int, default=1, help='perform denorm misstsm')
     parser.add_argument('--inverted', type=int, default=1, help='perform inverted misstsm')
     parser.add_argument('--skip_connection', type=int, default=1, help='add skipconnection to misstsm')
+    parser.add_argument('--observed_only', type=int, default=0, help='embed only the observed values, the missing (zero-filled) ones share one embedding per sample and feature; same output as the dense path')
+    parser.add_argument('--mtsm_chunk_size', type=int, default=0, help='process the misstsm layer this many timesteps at a time, 0 for all at once')
+    parser.add_argument('--mtsm_checkpoint', type=int, default=0, help='recompute misstsm activations in backward instead of storing them')
+    parser.add_argument('--mtsm_queries', type=int, default=1, help='number of learned misstsm queries per timestep')
+    parser.add_argument('--mtsm_kv_groups', type=int, default=0, help='key/value groups shared by the misstsm heads (grouped-query attention), 0 for nn.MultiheadAttention')
+    parser.add_argument('--mtsm_stream', type=int, default=0, help='impute the test windows with MissTSM.stream, one new timestep per window (needs --inverted 0 --skip_connection 0)')
 
     # optimization
     parser.add_argument('--num_workers', type=int, default=10, help='data loader num workers')
+    parser.add_argument('--batch_windows', type=int, default=1, help='gather each batch of windows in one indexing operation instead of per-window __getitem__')
+    parser.add_argument('--data_cache_dir', type=str, default='', help='directory of the memory-mapped cache of parsed datasets (e.g. ./dataset_cache/), disabled when empty')
+    parser.add_argument('--stream_chunk_rows', type=int, default=0, help='parse the data file into the dataset cache this many rows at a time (requires --data_cache_dir), for series larger than memory; 0 parses it whole')
+    parser.add_argument('--storage_dtype', type=str, default='float32', choices=['float32', 'float16', 'bfloat16'], help='precision of the stored series values, widened to float32 per batch (check with parity_storage.py)')
     parser.add_argument('--itr', type=int, default=1, help='experiments times')
     parser.add_argument('--train_epochs', type=int, default=10, help='train epochs')
     parser.add_argument('--batch_size', type=int, default=32, help='batch size of train input data')
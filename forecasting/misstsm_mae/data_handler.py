@@ -11,12 +11,21 @@ import json
 import pandas as pd
 import math
 import datetime
-import timefeatures
+from misstsm import timefeatures
 
 from utils.util import Utils
+from misstsm.data_cache import cached
+from misstsm.data_source import read_table
 from functools import partial
 
 
+def source_path(args, root_path, data_path):
+    '''
+    path of the data file, with the suffix of args.source_format
+    '''
+    return os.path.join(root_path, data_path) + '.' + getattr(args, 'source_format', 'csv')
+
+
 class ETTHour():
     
     def __init__(self, args, target='OT'):
@@ -35,9 +44,7 @@ class ETTHour():
             root_path=self.args.root_path
             data_path=self.args.source_filename
             
-        filepath = os.path.join(root_path, data_path)
-        
-        df = pd.read_csv(filepath+'.csv')
+        df = read_table(source_path(self.args, root_path, data_path))
 
         self.features_col = df.columns[1:]
         self.date_col = df.columns[0]
@@ -50,14 +57,10 @@ class ETTHour():
         df_date[self.date_col] = pd.to_datetime(df_date[self.date_col])
 
         if self.args.timeenc==0:
-            df_date['month'] = df_date.date.apply(lambda row: row.month, 1)
-            df_date['day'] = df_date.date.apply(lambda row: row.day, 1)
-            df_date['weekday'] = df_date.date.apply(lambda row: row.weekday(), 1)
-            df_date['hour'] = df_date.date.apply(lambda row: row.hour, 1)
-            df_date = df_date.drop(['date'], 1)
+            names = ('month', 'day', 'weekday', 'hour')
+            df_date = pd.DataFrame(timefeatures.calendar_features(df_date[self.date_col], names), columns=names)
         elif self.args.timeenc==1:
-            df_date = time_features(pd.to_datetime(df_date['date'].values), freq=self.args.freq)
-            df_date = df_date.transpose(1, 0)
+            df_date = pd.DataFrame(timefeatures.time_features(df_date[self.date_col], freq=self.args.freq).transpose(1, 0))
         else:
             # No time features
             return df[self.features_col]
@@ -84,9 +87,7 @@ class ETTMin():
             root_path=self.args.root_path
             data_path=self.args.source_filename
             
-        filepath = os.path.join(root_path, data_path)
-        
-        df = pd.read_csv(filepath+'.csv')
+        df = read_table(source_path(self.args, root_path, data_path))
 
         self.features_col = df.columns[1:]
         self.date_col = df.columns[0]
@@ -99,16 +100,10 @@ class ETTMin():
         df_date[self.date_col] = pd.to_datetime(df_date[self.date_col])
 
         if self.args.timeenc==0:
-            df_date['month'] = df_date.date.apply(lambda row: row.month, 1)
-            df_date['day'] = df_date.date.apply(lambda row: row.day, 1)
-            df_date['weekday'] = df_date.date.apply(lambda row: row.weekday(), 1)
-            df_date['hour'] = df_date.date.apply(lambda row: row.hour, 1)
-            df_date['minute'] = df_date.date.apply(lambda row: row.minute, 1)
-            df_date['minute'] = df_date.minute.map(lambda x: x // 15)
-            df_date = df_date.drop(['date'], 1)
+            names = ('month', 'day', 'weekday', 'hour', 'minute')
+            df_date = pd.DataFrame(timefeatures.calendar_features(df_date[self.date_col], names), columns=names)
         elif self.args.timeenc==1:
-            df_date = time_features(pd.to_datetime(df_date['date'].values), freq=self.args.freq)
-            df_date = df_date.transpose(1, 0)
+            df_date = pd.DataFrame(timefeatures.time_features(df_date[self.date_col], freq=self.args.freq).transpose(1, 0))
         else:
             # No time features
             return df[self.features_col]
@@ -136,9 +131,7 @@ class Custom():
             root_path=self.args.root_path
             data_path=self.args.source_filename
         
-        filepath = os.path.join(root_path, data_path)
-        
-        df = pd.read_csv(filepath+'.csv')
+        df = read_table(source_path(self.args, root_path, data_path))
 
         self.features_col = df.columns[1:]
         self.date_col = df.columns[0]
@@ -159,16 +152,10 @@ class Custom():
         df_date[self.date_col] = pd.to_datetime(df_date[self.date_col])
         
         if self.args.timeenc==0:
-            df_date['month'] = df_date.date.apply(lambda row: row.month, 1)
-            df_date['day'] = df_date.date.apply(lambda row: row.day, 1)
-            df_date['weekday'] = df_date.date.apply(lambda row: row.weekday(), 1)
-            df_date['hour'] = df_date.date.apply(lambda row: row.hour, 1)
-            df_date['minute'] = df_date.date.apply(lambda row: row.minute, 1)
-            df_date['minute'] = df_date.minute.map(lambda x: x // 15)
-            df_date = df_date.drop(['date'], 1)
+            names = ('month', 'day', 'weekday', 'hour', 'minute')
+            df_date = pd.DataFrame(timefeatures.calendar_features(df_date[self.date_col], names), columns=names)
         elif self.args.timeenc==1:
-            df_date = time_features(pd.to_datetime(df_date['date'].values), freq=self.args.freq)
-            df_date = df_date.transpose(1, 0)
+            df_date = pd.DataFrame(timefeatures.time_features(df_date[self.date_col], freq=self.args.freq).transpose(1, 0))
         else:
             # No time features
             return df[self.features_col]
@@ -195,6 +182,9 @@ class DataHandler():
             
     def handle(self, gt=None):
         
+        if getattr(self.args, 'data_cache_dir', ''):
+            return self.handle_cached(gt)
+        
         self.handler = self.dataClass(self.args)
         
         '''
@@ -221,23 +211,68 @@ class DataHandler():
         train_df, val_df, test_df = utils.split_data(df_X, self.handler.split_ratios)
         
         '''
-        create windowed dataset or load one 
+        standardize the series with the statistics of the train series
         '''
-        data_path = os.path.join(self.args.root_path, self.args.dataset)
-        
-        train_X = utils.perform_windowing(train_df, data_path, name=self.args.source_filename, split='train')
-        val_X = utils.perform_windowing(val_df, data_path, name=self.args.source_filename, split='val')
-        test_X = utils.perform_windowing(test_df, data_path, name=self.args.source_filename, split='test')
+        train_S = torch.from_numpy(train_df.values).type(torch.Tensor)
+        val_S = torch.from_numpy(val_df.values).type(torch.Tensor)
+        test_S = torch.from_numpy(test_df.values).type(torch.Tensor)
+
+        train_S = utils.normalize_tensor(train_S[None], use_stat=False)[0]
+        val_S = utils.normalize_tensor(val_S[None], use_stat=True)[0]
+        test_S = utils.normalize_tensor(test_S[None], use_stat=True)[0]
         
         '''
-        standardize the data
+        windowed datasets, strided views of the series
         '''
-        train_X = torch.from_numpy(train_X).type(torch.Tensor)
-        val_X = torch.from_numpy(val_X).type(torch.Tensor)
-        test_X = torch.from_numpy(test_X).type(torch.Tensor)
+        train_X = utils.perform_windowing(train_S)
+        val_X = utils.perform_windowing(val_S)
+        test_X = utils.perform_windowing(test_S)
+        
+        return train_X, val_X, test_X, utils
 
-        train_X = utils.normalize_tensor(train_X, use_stat=False)
-        val_X = utils.normalize_tensor(val_X, use_stat=True)
-        test_X = utils.normalize_tensor(test_X, use_stat=True)
+    def handle_cached(self, gt=None):
+        '''
+        handle() with the parsed values, split borders and train statistics kept in the memory-mapped
+        dataset cache, a warm start reads no csv
+        '''
+        self.handler = self.dataClass(self.args)
+        utils = Utils(inp_cols=None, date_col=None, args=self.args, stride=1)
         
-        return train_X, val_X, test_X, utils
\ No newline at end of file
+        filepath = source_path(self.args, self.args.root_path, self.args.source_filename)
+        # the windows are views made on load, the entry holds the series only
+        params = dict(dataset=self.dataClass.__name__, series=True, timeenc=self.args.timeenc, freq=self.args.freq)
+        
+        def parse():
+            df = self.handler.read_data()
+            df_X = self.handler.add_time_feats(df)
+            utils.inp_cols = self.handler.features_col
+            
+            train_df, val_df, test_df = utils.split_data(df_X, self.handler.split_ratios)
+            borders = [0, len(train_df), len(train_df) + len(val_df), len(df_X)]
+            values = df_X.values.astype(np.float32)
+            
+            # statistics of the train series, as computed by handle
+            utils.normalize_tensor(torch.tensor(values[None, :borders[1]]))
+            meta = {'features_col': list(self.handler.features_col),
+                    'date_col': self.handler.date_col,
+                    'borders': borders,
+                    'feat_mean': utils.feat_mean.flatten().tolist(),
+                    'feat_std': utils.feat_std.flatten().tolist()}
+            return meta, {'values': values}
+        
+        meta, arrays = cached(self.args.data_cache_dir, filepath, params, parse)
+        
+        self.handler.features_col = pd.Index(meta['features_col'])
+        self.handler.date_col = meta['date_col']
+        utils.inp_cols = self.handler.features_col
+        utils.date_col = self.handler.date_col
+        utils.feat_mean = torch.tensor(meta['feat_mean'])[None, None, :]
+        utils.feat_std = torch.tensor(meta['feat_std'])[None, None, :]
+        
+        splits = []
+        for border1, border2 in zip(meta['borders'][:-1], meta['borders'][1:]):
+            series = utils.normalize_tensor(torch.tensor(arrays['values'][None, border1:border2]), use_stat=True)[0]
+            splits.append(utils.perform_windowing(series))
+        train_X, val_X, test_X = splits
+        
+        return train_X, val_X, test_X, utils
@@ -1,6 +1,8 @@
+import os
 import sys
 sys.path.insert(1, './utils/')
 sys.path.append('../')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 
 import warnings
 import argparse
@@ -12,11 +14,13 @@ import json
 import pandas as pd
 import math
 import datetime
-import timefeatures
+import copy
+import wandb
+from misstsm import timefeatures
 
 from trainer import Trainer
 from model import MaskedAutoencoder
-from utils.util import Utils
+from utils.util import Utils, rewindow
 from tools import transfer_weights
 from functools import partial
 from data_handler import DataHandler
@@ -39,6 +43,8 @@ parser.add_argument('--root_path', type=str, default='./forecasting_datasets/',
 parser.add_argument('--source_filename', type=str, default='ETTh1', help='name of the data file')
 parser.add_argument('--gt_root_path', type=str, default=None, help='path to ground-truth data')
 parser.add_argument('--gt_source_filename', type=str, default=None, help='path to ground-truth filename')
+parser.add_argument('--source_format', type=str, default='csv', choices=['csv', 'parquet', 'feather'], help='format (and file suffix) of the data files, convert with python -m misstsm.data_source')
+parser.add_argument('--data_cache_dir', type=str, default='', help='directory of the memory-mapped cache of parsed datasets (e.g. ./dataset_cache/), disabled when empty')
 parser.add_argument('--timeenc', type=int, default=2, choices=[0, 1, 2], help='0 indicates traditional time features, 1 indicates time-features , 2 indicates no time-feature creation')
 parser.add_argument('--freq', type=str, default='h', help='freq for time features encoding, options:[s:secondly, t:minutely, h:hourly, d:daily, b:business days, w:weekly, m:monthly], you can also use more detailed freq like 15min or 3h')
 
@@ -57,7 +63,9 @@ parser.add_argument('--num_windows', type=int, default=25, help='number of windo
 parser.add_argument('--feature_wise_mse', type=str, default='True', help='whether to plot feature-wise mse')
 
 parser.add_argument('--pred_len', type=int, default=96, help='past sequence length')
+parser.add_argument('--pred_len_list', type=str, default='', help='comma-separated horizons finetuned one after another in this process from one load of the data and pretrained model, and with --cache_latents one set of encoder latents (e.g. 96,192,336,720), overrides pred_len')
 parser.add_argument('--freeze_encoder', type=str, default='True', help='whether to freeze encoder or not')
+parser.add_argument('--cache_latents', type=str, default='none', choices=['none', 'memory', 'disk'], help='with a frozen encoder, compute the encoder latents of all windows once (kept in memory or memory-mapped in the finetune checkpoints dir) and train only the forecasting head on them; unlike none, this also freezes the variable query, cls token and encoder norm (the frozen encoder runs in eval mode either way)')
 parser.add_argument('--n2one', type=bool, default=False, help='multivariate featurest to univariate target')
 parser.add_argument('--patience', type=int, default=3, help='early stopping patience')
 parser.add_argument('--pct_start', type=float, default=0.3, help='pct_start')
@@ -73,6 +81,7 @@ parser.add_argument('--decoder_depth', type=int, default=2, help='number of deco
 parser.add_argument('--decoder_num_heads', type=int, default=4, help='number of decoder multi-attention heads')
 parser.add_argument('--decoder_embed_dim', type=int, default=32, help='decoder embedding dimension in the feature space')
 parser.add_argument('--mlp_ratio', type=int, default=4, help='mlp ratio for vision transformer')
+parser.add_argument('--grad_checkpoint', type=str, default='False', help='recompute the activations of each encoder/decoder block in backward instead of storing them, less memory for more compute')
 
 # training 
 parser.add_argument('--batch_size', type=int, default=32)
@@ -114,8 +123,11 @@ args.device = 'cuda:' + args.device if torch.cuda.is_available() else 'cpu'
 
     
 '''
-read and process data
+read and process data, windowed at the longest horizon of a sweep
 '''
+pred_lens = [int(pred_len) for pred_len in args.pred_len_list.split(',')] if args.pred_len_list else [args.pred_len]
+args.pred_len = max(pred_lens)
+
 dh = DataHandler(args)
 train_X, val_X, test_X, utils = dh.handle()
 
@@ -138,44 +150,82 @@ if args.task_name=='pretrain':
         
 elif args.task_name=='finetune':
     
-    args.finetune_checkpoints_dir = os.path.join(args.finetune_checkpoints_dir, base_run_name) 
-    
-    if not os.path.exists(args.finetune_checkpoints_dir):
-        os.makedirs(args.finetune_checkpoints_dir)
-    
     load_model_path = os.path.join(args.pretrain_checkpoints_dir, args.pretrain_run_name, args.pretrain_ckpt_name)
     
-    model = MaskedAutoencoder(utils, args, num_feats=len(dh.handler.features_col))
-    
     '''
-    Training phase
+    the pretrained model and the ground-truth data are loaded once for every horizon
     '''
     print(f"load_model_path = {load_model_path}")
     
     if os.path.exists(load_model_path):
-        print(f"Transferring weights from pretrained model")
-        model = transfer_weights(load_model_path, model, device=args.device)
+        pretrained_state = torch.load(load_model_path, map_location=args.device).state_dict()
     else:
+        pretrained_state = None
         print(f"No pretrained weights found")
     
-    trainer = Trainer(args=vars(args), model=model, utils=utils)
-    
-    history, model = trainer.finetune(train_X, val_X, test_X)
+    _, _, gt_test_X, _ = dh.handle(gt=True)
     
-    save_model_path = os.path.join(args.finetune_checkpoints_dir, args.ckpt_name)
-    torch.save(model, save_model_path) # saves the final model; may not be the best model
+    # latents of a frozen encoder, computed once for the windows of the shortest horizon
+    latents = None
     
-    '''
-    Testing phase
-    '''
-    _, _, test_X_, _ = dh.handle(gt=True)
-    
-    best_model_path = os.path.join(args.finetune_checkpoints_dir, 'checkpoint.pth')
-    
-    print(f"Loading best fine-tuned model for testing ...")
-    
-    ft_model = torch.load(best_model_path, map_location='cpu').to(args.device)
-    
-    trainer.test(ft_model, test_X_)
+    for pred_len in pred_lens:
+        
+        '''
+        horizon settings, and windows of seq_len + pred_len over the same series (views, nothing is copied)
+        '''
+        run_args = copy.copy(args)
+        run_args.pred_len = pred_len
+        run_name = base_run_name
+        if len(pred_lens) > 1:
+            run_name = "{}_PRED_{}".format(base_run_name, pred_len)
+            run_args.run_name = "{}_PRED_{}".format(args.run_name, pred_len)
+        run_args.finetune_checkpoints_dir = os.path.join(args.finetune_checkpoints_dir, run_name) 
+        
+        if not os.path.exists(run_args.finetune_checkpoints_dir):
+            os.makedirs(run_args.finetune_checkpoints_dir)
+        
+        window = args.seq_len + pred_len
+        train_W, val_W, test_W, gt_test_W = [rewindow(X, window) for X in (train_X, val_X, test_X, gt_test_X)]
+        utils.pred_len = pred_len
+        utils.pre_train_window = window
+        
+        # every horizon starts from the same random state, as in a run of its own
+        random.seed(fix_seed)
+        torch.manual_seed(fix_seed)
+        np.random.seed(fix_seed)
+        
+        model = MaskedAutoencoder(utils, run_args, num_feats=len(dh.handler.features_col))
+        
+        '''
+        Training phase
+        '''
+        if pretrained_state is not None:
+            print(f"Transferring weights from pretrained model")
+            model = transfer_weights(load_model_path, model, device=args.device, state_dict=pretrained_state)
+        
+        trainer = Trainer(args=vars(run_args), model=model, utils=utils)
+        
+        if trainer.caches_latents() and latents is None:
+            window_min = args.seq_len + min(pred_lens)
+            latents = trainer.encode_splits(*[rewindow(X, window_min) for X in (train_X, val_X, test_X)])
+        
+        history, model = trainer.finetune(train_W, val_W, test_W, latents=latents)
+        
+        save_model_path = os.path.join(run_args.finetune_checkpoints_dir, args.ckpt_name)
+        torch.save(model, save_model_path) # saves the final model; may not be the best model
+        
+        '''
+        Testing phase
+        '''
+        best_model_path = os.path.join(run_args.finetune_checkpoints_dir, 'checkpoint.pth')
+        
+        print(f"Loading best fine-tuned model for testing ...")
+        
+        ft_model = torch.load(best_model_path, map_location='cpu').to(args.device)
+        
+        trainer.test(ft_model, gt_test_W)
+        
+        if len(pred_lens) > 1:
+            wandb.finish()
     
 print(f"Done with model {args.task_name} ")
\ No newline at end of file
@@ -16,10 +16,12 @@ from functools import partial
 from torch.optim import lr_scheduler
 from timm.models.vision_transformer import Block
 from positional_encodings.torch_encodings import PositionalEncoding1D, PositionalEncoding2D
-from utils.util import MaskEmbed, MAEDataset, NativeScaler, get_1d_sincos_pos_embed, ActiveEmbed, FeatEmbed, adjust_learning_rate
+from utils.util import MaskEmbed, MAEDataset, NativeScaler, get_1d_sincos_pos_embed, ActiveEmbed, FeatEmbed, adjust_learning_rate, single_query_attention, apply_blocks
 
 class DecoderWithLinearHead(nn.Module):
     
+    grad_checkpoint = False
+    
     def __init__(self, args, num_feats, cls_token, norm_layer=nn.LayerNorm):
         super().__init__()
         self.encoder_embed_dim = args.encoder_embed_dim
@@ -32,6 +34,7 @@ class DecoderWithLinearHead(nn.Module):
         self.pred_len = args.pred_len
         self.num_feats = num_feats
         self.cls_token = cls_token
+        self.grad_checkpoint = args.grad_checkpoint=='True'
         
         self.decoder_embed = nn.Linear(self.encoder_embed_dim, self.decoder_embed_dim, bias=True)
         
@@ -65,8 +68,7 @@ class DecoderWithLinearHead(nn.Module):
         # remove cls token
         x = x[:, 1:, :]
         
-        for blk in self.decoder_blocks:
-            x = blk(x)
+        x = apply_blocks(self.decoder_blocks, x, self.grad_checkpoint)
         x = self.decoder_norm(x)
         
         x = self.decoder_pred(x)
@@ -111,6 +113,9 @@ class MaskedAutoencoder(nn.Module):
     Masked Autoencoder with Transformer backbone
     """
     
+    # models pickled before the option was added
+    grad_checkpoint = False
+    
     def __init__(self,
                  utils,
                  args,
@@ -142,6 +147,7 @@ class MaskedAutoencoder(nn.Module):
         self.mask_ratio = args.mask_ratio
         self.dropout = args.dropout
         self.task_name = args.task_name
+        self.grad_checkpoint = args.grad_checkpoint=='True'
         self.seq_len = args.seq_len
         self.pred_len = args.pred_len
         
@@ -196,9 +202,12 @@ class MaskedAutoencoder(nn.Module):
         
         # w = self.mask_embed.proj.weight.data
         # torch.nn.init.xavier_uniform_(w.view([w.shape[0], -1]))
-        w = [self.mask_embed.embeddings[i][0].weight.data for i in range(self.num_feats)]
+        w = self.mask_embed.weight.data
         for i in range(self.num_feats):
-            torch.nn.init.xavier_uniform_(w[i].view([w[i].shape[0], -1]))
+            torch.nn.init.xavier_uniform_(w[i].view([w.shape[1], -1]))
+        nn.init.constant_(self.mask_embed.bias, 0)
+        nn.init.constant_(self.mask_embed.norm_weight, 1.0)
+        nn.init.constant_(self.mask_embed.norm_bias, 0)
 
         # timm's trunc_normal_(std=.02) is effectively normal_(std=0.02) as cutoff is too big (2.)
         torch.nn.init.normal_(self.cls_token, std=.02)
@@ -297,16 +306,7 @@ class MaskedAutoencoder(nn.Module):
 
     def cross_attention(self, x, m):
         
-        batch_size, window_size, num_feat, d = x.shape
-        var_query = self.var_query.repeat_interleave(batch_size*window_size, dim=0)
-        
-        x = x.view(-1, num_feat, d)
-        
-        m_ = copy.deepcopy(m.reshape(-1, num_feat))
-        
-        attn_out, _ = self.mhca(var_query, x, x, key_padding_mask=m_)
-        
-        attn_out = attn_out.reshape(batch_size, window_size, d)
+        attn_out = single_query_attention(self.var_query, x, self.mhca, key_padding_mask=m)
         
         return attn_out
     
@@ -346,8 +346,7 @@ class MaskedAutoencoder(nn.Module):
         x = torch.cat((cls_tokens, x), dim=1)
         
         # apply Transformer blocks
-        for blk in self.encoder_blocks:
-            x = blk(x)
+        x = apply_blocks(self.encoder_blocks, x, self.grad_checkpoint)
         x = self.norm(x)
         
         if self.task_name=='pretrain':
@@ -372,8 +371,7 @@ class MaskedAutoencoder(nn.Module):
         x = x + self.mpl.decoder_pos_embed
 
         # apply Transformer blocks
-        for blk in self.decoder_blocks:
-            x = blk(x)
+        x = apply_blocks(self.decoder_blocks, x, self.grad_checkpoint)
         x = self.decoder_norm(x)
         
         # predictor projection
@@ -434,7 +432,14 @@ class MaskedAutoencoder(nn.Module):
             return pred, mask, nask
         
         elif self.task_name=='finetune':
-            latent, means, std = self.forward_encoder(data, miss_idx)
-            latent = latent[:, 1:, :]
+            latent, means, std = self.encode(data, miss_idx, mpl)
             pred = self.fh(latent, means, std)
-            return pred
\ No newline at end of file
+            return pred
+
+    def encode(self, data, miss_idx, mpl):
+        '''
+        finetuning: encoder latents of the input windows w/o cls token, and their rev-in stats
+        '''
+        self.mpl = mpl
+        latent, means, std = self.forward_encoder(data, miss_idx)
+        return latent[:, 1:, :], means, std
\ No newline at end of file
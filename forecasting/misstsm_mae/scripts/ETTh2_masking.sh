@@ -16,8 +16,6 @@ GT_ROOT_PATH="./data/forecasting_datasets/ETT/"
 
 OUTPUT_PATH="./outputs/${MASKINGTYPE}/ETTh2_v${TRIAL}/"
 
-IFS=',' read -r -a PRED_LEN_ARRAY <<< "$PRED_LEN_LIST"
-
 for id in $ROOT_PATHS; do
     
     root_path="${BASE_PATH}${id}"
@@ -44,30 +42,28 @@ for id in $ROOT_PATHS; do
         --trial $TRIAL
 
     # FINETUNE WITH NON-FROZEN ENCODER
-    for pred_len in ${PRED_LEN_ARRAY[@]}; do
-        python -u executor.py \
-            --task_name finetune \
-            --device $DEVICE \
-            --root_path $root_path \
-            --gt_root_path $GT_ROOT_PATH \
-            --gt_source_filename $GT_SOURCE_FILE \
-            --run_name "v${TRIAL}_${MASKINGTYPE}_new_finetune_${DATASET}_PRED_${pred_len}_${id}" \
-            --pretrain_run_name "v${TRIAL}_${MASKINGTYPE}_new_pretrain_${DATASET}_${id}" \
-            --freeze_encoder "False" \
-            --max_epochs $FINETUNE_EPOCHS \
-            --dataset $DATASET \
-            --pred_len $pred_len \
-            --source_filename $SOURCE_FILE \
-            --pretrain_ckpt_name ckpt_best.pth \
-            --encoder_depth 1 \
-            --encoder_num_heads 8 \
-            --encoder_embed_dim 8 \
-            --lr 0.0001 \
-            --dropout 0.2 \
-            --fc_dropout 0.006 \
-            --batch_size 16 \
-            --project_name ett_masking \
-            --output_path $OUTPUT_PATH \
-            --trial $TRIAL
-    done
+    python -u executor.py \
+        --task_name finetune \
+        --device $DEVICE \
+        --root_path $root_path \
+        --gt_root_path $GT_ROOT_PATH \
+        --gt_source_filename $GT_SOURCE_FILE \
+        --run_name "v${TRIAL}_${MASKINGTYPE}_new_finetune_${DATASET}_${id}" \
+        --pretrain_run_name "v${TRIAL}_${MASKINGTYPE}_new_pretrain_${DATASET}_${id}" \
+        --freeze_encoder "False" \
+        --max_epochs $FINETUNE_EPOCHS \
+        --dataset $DATASET \
+        --pred_len_list $PRED_LEN_LIST \
+        --source_filename $SOURCE_FILE \
+        --pretrain_ckpt_name ckpt_best.pth \
+        --encoder_depth 1 \
+        --encoder_num_heads 8 \
+        --encoder_embed_dim 8 \
+        --lr 0.0001 \
+        --dropout 0.2 \
+        --fc_dropout 0.006 \
+        --batch_size 16 \
+        --project_name ett_masking \
+        --output_path $OUTPUT_PATH \
+        --trial $TRIAL
 done
\ No newline at end of file
@@ -16,8 +16,6 @@ GT_ROOT_PATH="./data/forecasting_datasets/ETT/"
 
 OUTPUT_PATH="./outputs/${MASKINGTYPE}/ETTm2_v${TRIAL}/"
 
-IFS=',' read -r -a PRED_LEN_ARRAY <<< "$PRED_LEN_LIST"
-
 for id in $ROOT_PATHS; do
     
     root_path="${BASE_PATH}${id}"
@@ -40,29 +38,27 @@ for id in $ROOT_PATHS; do
         --trial $TRIAL
 
     # FINETUNE WITH NON-FROZEN ENCODER
-    for pred_len in ${PRED_LEN_ARRAY[@]}; do
-        python -u executor.py \
-            --task_name finetune \
-            --device $DEVICE \
-            --root_path $root_path\
-            --gt_root_path $GT_ROOT_PATH \
-            --gt_source_filename $GT_SOURCE_FILE \
-            --run_name "v${TRIAL}_${MASKINGTYPE}_finetune_${DATASET}_PRED_${pred_len}_${id}" \
-            --pretrain_run_name "v${TRIAL}_${MASKINGTYPE}_pretrain_${DATASET}_${id}" \
-            --freeze_encoder "False" \
-            --max_epochs $FINETUNE_EPOCHS \
-            --dataset $DATASET \
-            --pred_len $pred_len \
-            --source_filename $SOURCE_FILE \
-            --pretrain_ckpt_name ckpt_best.pth \
-            --encoder_depth 3 \
-            --encoder_num_heads 8 \
-            --encoder_embed_dim 32 \
-            --lr 0.0001 \
-            --dropout 0.0 \
-            --batch_size 64 \
-            --project_name ett_masking \
-            --output_path $OUTPUT_PATH \
-            --trial $TRIAL
-    done
+    python -u executor.py \
+        --task_name finetune \
+        --device $DEVICE \
+        --root_path $root_path\
+        --gt_root_path $GT_ROOT_PATH \
+        --gt_source_filename $GT_SOURCE_FILE \
+        --run_name "v${TRIAL}_${MASKINGTYPE}_finetune_${DATASET}_${id}" \
+        --pretrain_run_name "v${TRIAL}_${MASKINGTYPE}_pretrain_${DATASET}_${id}" \
+        --freeze_encoder "False" \
+        --max_epochs $FINETUNE_EPOCHS \
+        --dataset $DATASET \
+        --pred_len_list $PRED_LEN_LIST \
+        --source_filename $SOURCE_FILE \
+        --pretrain_ckpt_name ckpt_best.pth \
+        --encoder_depth 3 \
+        --encoder_num_heads 8 \
+        --encoder_embed_dim 32 \
+        --lr 0.0001 \
+        --dropout 0.0 \
+        --batch_size 64 \
+        --project_name ett_masking \
+        --output_path $OUTPUT_PATH \
+        --trial $TRIAL
 done
\ No newline at end of file
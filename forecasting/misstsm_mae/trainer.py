@@ -19,7 +19,7 @@ from tqdm import trange, tqdm
 from torch.utils.data import DataLoader, RandomSampler
 from torch.optim import lr_scheduler
 from timm.models.vision_transformer import Block
-from utils.util import MaskEmbed, MAEDataset, NativeScaler, get_1d_sincos_pos_embed, ActiveEmbed, FeatEmbed, adjust_learning_rate
+from utils.util import MaskEmbed, LatentDataset, WindowBatches, NativeScaler, get_1d_sincos_pos_embed, get_2d_pos_embed, ActiveEmbed, FeatEmbed, adjust_learning_rate
 from positional_encodings.torch_encodings import PositionalEncoding1D, PositionalEncoding2D
 from tools import EarlyStopping, adjust_learning_rate, visual
 
@@ -54,7 +54,6 @@ class ModelPlugins():
         self.num_feats = num_feats
         
         # self.pos_embed = nn.Parameter(torch.zeros(1, self.window_len + 1, self.enc_embed_dim), requires_grad=False).to(self.device)
-        self.pos_embed = PositionalEncoding2D(enc_embed_dim).to(self.device)
         
         self.decoder_pos_embed = nn.Parameter(torch.zeros(1, self.window_len + 1, self.dec_embed_dim), requires_grad=False).to(self.device)
         # self.decoder_pos_embed = PositionalEncoding2D(dec_embed_dim).to(self.device)
@@ -68,8 +67,7 @@ class ModelPlugins():
     
     def initialize_embeddings(self):
         
-        enc_z = torch.rand((1, self.window_len + 1, self.num_feats, self.enc_embed_dim)).to(self.device) # +1 for the cls token
-        self.pos_embed = self.pos_embed(enc_z)
+        self.pos_embed = get_2d_pos_embed(self.window_len + 1, self.num_feats, self.enc_embed_dim, self.device) # +1 for the cls token
         
 #         pos_embed = get_1d_sincos_pos_embed(self.pos_embed.shape[-1], self.window_len, cls_token=True)
 #         self.pos_embed.data.copy_(torch.from_numpy(pos_embed).float().unsqueeze(0))
@@ -120,6 +118,92 @@ class Trainer():
             param.requires_grad = False
                 
         print(f"Encoder Blocks Frozen!")
+
+    def frozen_eval(self):
+        # the frozen encoder runs in eval mode, as when its latents are cached by encode_windows
+        for module in (self.model.encoder_blocks, self.model.mask_embed, self.model.mhca):
+            module.eval()
+
+    def freeze_all_but_head(self):
+        # cached latents also depend on the query, cls token and norm, which freeze_encoder_model keeps trainable
+        for name, param in self.model.named_parameters():
+            if not name.startswith('fh.'):
+                param.requires_grad = False
+
+        print(f"Encoder Frozen, training the head on cached latents ({self.args['cache_latents']})")
+
+    def latent_buffer(self, name, shape):
+        if self.args['cache_latents'] != 'disk':
+            return torch.empty(shape)
+        folder = os.path.join(self.finetune_checkpoints_dir, 'latents')
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, name + '.npy')
+        return torch.from_numpy(np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape))
+
+    def caches_latents(self):
+        return self.args['freeze_encoder']=='True' and self.args['cache_latents']!='none'
+
+    def encode_splits(self, Xtrain, Xval, Xtest):
+        '''
+        encode_windows of the train, val and test windows with the pretrained encoder
+        '''
+        self.model.to(self.device)
+        start_time = time.time()
+        latents = {split: self.encode_windows(X, split) for split, X in zip(['train', 'val', 'test'], [Xtrain, Xval, Xtest])}
+        print("Encoder latents cached in {:.2f}s".format(time.time() - start_time))
+        return latents
+
+    def encode_windows(self, X, split):
+        '''
+        latents [N x seq_len x d], rev-in means and std [N x 1 x F] of the frozen encoder for the input
+        part of the windows X, in memory or memory-mapped from the checkpoints dir
+        '''
+        self.model.eval()
+        dataloader = WindowBatches(X, self.batch_size, self.device)
+        buffers = None
+        start = 0
+        with torch.no_grad():
+            for samples, masks in dataloader:
+                sample_X = samples[:, :self.seq_len, :]
+                mask_X = masks[:, :self.seq_len, :].float()
+
+                with torch.cuda.amp.autocast():
+                    outputs = self.model.encode(sample_X, mask_X, self.mpl)
+
+                if buffers is None:
+                    buffers = [self.latent_buffer(split + '_' + name, (len(X),) + tuple(out.shape[1:]))
+                               for name, out in zip(['latent', 'means', 'std'], outputs)]
+                for buffer, out in zip(buffers, outputs):
+                    buffer[start:start + len(out)] = out.float().cpu()
+                start += len(samples)
+        return buffers
+
+    def forecast_batch(self, model, batch):
+        '''
+        pred, sample_Y, mask_Y of a batch of windows (samples, masks), or of cached latents
+        (latent, means, std, sample_Y, mask_Y) through the forecasting head only
+        '''
+        if len(batch) == 2:
+            samples, masks = batch
+            sample_X = samples[:, :self.seq_len, :]
+            sample_Y = samples[:, -self.pred_len:, :]
+
+            mask_X = masks[:, :self.seq_len, :].float()
+            mask_Y = masks[:, -self.pred_len:, :].float()
+
+            with torch.cuda.amp.autocast():
+                pred = model(sample_X, mask_X, self.mpl)
+        else:
+            latent, means, std, sample_Y, mask_Y = [t.to(self.device) for t in batch]
+            mask_Y = mask_Y.float()
+
+            with torch.cuda.amp.autocast():
+                pred = model.fh(latent, means, std)
+
+        if self.n2one_ft==True:
+            sample_Y = sample_Y[:, :, self.utils.target_index].unsqueeze(2)
+
+        return pred, sample_Y, mask_Y
         
     def select_optimizer_(self):
         optimizer = torch.optim.Adam(self.model.parameters(), lr=self.lr)
@@ -129,18 +213,16 @@ class Trainer():
         loss_scaler = NativeScaler()
         return loss_scaler
     
-    def get_data(self, X, split_flag):
-        
-        M = 1 - (1 * (torch.isnan(X)))
-        M = M.float()
-        
-        X = torch.nan_to_num(X)
+    def get_data(self, X, split_flag, latents=None):
         
         '''
-        Dataloader
+        Dataloader: batches gathered from the windows on device, or over their cached encoder latents
         '''
+        if latents is None:
+            return WindowBatches(X, self.batch_size, self.device, shuffle=split_flag!='test', drop_last=split_flag=='test')
+        
+        dataset = LatentDataset(*latents, X, self.pred_len)
         if split_flag=='test':
-            dataset = MAEDataset(X, M)
             dataloader = DataLoader(
                 dataset,
                 shuffle=False,
@@ -148,7 +230,6 @@ class Trainer():
                 drop_last=True
             )
         else:
-            dataset = MAEDataset(X, M)
             dataloader = DataLoader(
                 dataset, sampler=RandomSampler(dataset),
                 batch_size=self.batch_size,
@@ -162,7 +243,7 @@ class Trainer():
         self.model.eval()
         for iteration, (samples, masks) in enumerate(dataloader):
             samples = samples.to(self.device)
-            masks = masks.to(self.device)
+            masks = masks.to(self.device).float()
 
             with torch.cuda.amp.autocast():
 
@@ -213,7 +294,7 @@ class Trainer():
         self.model.train()
         for iteration, (samples, masks) in enumerate(dataloader):
             samples = samples.to(self.device)
-            masks = masks.to(self.device)
+            masks = masks.to(self.device).float()
 
             with torch.cuda.amp.autocast():
 
@@ -272,27 +353,8 @@ class Trainer():
         
         config = init_wandb(self.args, self.task_name)
         
-        # Set missing Train
-        M = 1 - (1 * (torch.isnan(Xtrain)))
-        M = M.float()#.to(self.device)
-        
-        Xtrain = torch.nan_to_num(Xtrain)
-        # Xtrain = Xtrain.to(self.device)
-        
-        # Set missing Val
-        M_val = 1 - (1 * (torch.isnan(Xval)))
-        M_val = M_val.float()#.to(self.device)
-        
-        Xval = torch.nan_to_num(Xval)
-        # Xval = Xval.to(self.device)
-        
-        # Set missing Test
-        M_test = 1 - (1 * (torch.isnan(Xtest)))
-        M_test = M_test.float()#.to(self.device)
-        
-        Xtest = torch.nan_to_num(Xtest)
-        # Xtest = Xtest.to(self.device)
-        
+        # the windows stay views of the series, moved once to the device; each batch is gathered there
+        # with its observed-value masks (see WindowBatches)
         self.model.to(self.device)
         
         n_batches = int(math.ceil(Xtrain.shape[0] / self.batch_size))
@@ -305,30 +367,17 @@ class Trainer():
         '''
         Train dataloader
         '''
-        train_dataset = MAEDataset(Xtrain, M)
-        self.train_dataloader = DataLoader(
-            train_dataset, sampler=RandomSampler(train_dataset),
-            batch_size=self.batch_size,
-        )
+        self.train_dataloader = WindowBatches(Xtrain, self.batch_size, self.device, shuffle=True)
         
         '''
         Val Dataloader
         '''
-        val_dataset = MAEDataset(Xval, M_val)
-        self.val_dataloader = DataLoader(
-            val_dataset, sampler=RandomSampler(val_dataset),
-            batch_size=self.batch_size,
-        )
+        self.val_dataloader = WindowBatches(Xval, self.batch_size, self.device, shuffle=True)
         
         '''
         Test Dataloader
         '''
-        test_dataset = MAEDataset(Xtest, M_test)
-        self.test_dataloader = DataLoader(
-            test_dataset, sampler=RandomSampler(test_dataset),
-            batch_size=self.batch_size,
-            drop_last=True
-        )
+        self.test_dataloader = WindowBatches(Xtest, self.batch_size, self.device, shuffle=True, drop_last=True)
         
         losses = np.full(self.max_epochs, np.nan)
         val_mse = []
@@ -408,7 +457,11 @@ class Trainer():
             
         return losses, self.model
     
-    def finetune(self, Xtrain=None, Xval=None, Xtest=None, masked_penalize=False):
+    def finetune(self, Xtrain=None, Xval=None, Xtest=None, masked_penalize=False, latents=None):
+        '''
+        latents: encode_splits of windows starting at the same rows as Xtrain, Xval and Xtest (e.g. shared
+        by the horizons of a sweep), computed here when None
+        '''
                
         num_windows = self.args["num_windows"]
         num_samples = self.args["num_samples"]
@@ -424,6 +477,10 @@ class Trainer():
         if self.args['freeze_encoder']=='True':
             self.freeze_encoder_model()
         
+        cache_latents = self.caches_latents()
+        if cache_latents:
+            self.freeze_all_but_head()
+        
         config = init_wandb(self.args, self.task_name)
         
         self.model.to(self.device)
@@ -435,9 +492,17 @@ class Trainer():
         if self.lr is None:  # only base_lr is specified
             self.lr = self.blr * eff_batch_size / 64
 
-        self.train_dataloader = self.get_data(Xtrain, split_flag='train')
-        self.val_dataloader = self.get_data(Xval, split_flag='val')
-        self.test_dataloader = self.get_data(Xtest, split_flag='test')
+        if not cache_latents:
+            latents = {'train': None, 'val': None, 'test': None}
+        else:
+            if latents is None:
+                latents = self.encode_splits(Xtrain, Xval, Xtest)
+            # longer windows are fewer, their latents are the leading ones
+            latents = {split: [t[:len(X)] for t in latents[split]] for split, X in zip(['train', 'val', 'test'], [Xtrain, Xval, Xtest])}
+        
+        self.train_dataloader = self.get_data(Xtrain, split_flag='train', latents=latents['train'])
+        self.val_dataloader = self.get_data(Xval, split_flag='val', latents=latents['val'])
+        self.test_dataloader = self.get_data(Xtest, split_flag='test', latents=latents['test'])
         
         losses = np.full(self.max_epochs, np.nan)
         val_mse = []
@@ -467,23 +532,16 @@ class Trainer():
                 optimizer.zero_grad()
 
                 self.model.train()
+                if self.args['freeze_encoder']=='True':
+                    self.frozen_eval()
                 epoch_time = time.time()
                 
-                for iteration, (samples, masks) in enumerate(self.train_dataloader):
-                    
-                    sample_X = copy.deepcopy(samples[:, :self.seq_len, :]).to(self.device)
-                    sample_Y = copy.deepcopy(samples[:, -self.pred_len:, :]).to(self.device)
+                for iteration, batch in enumerate(self.train_dataloader):
                     
-                    mask_X = copy.deepcopy(masks[:, :self.seq_len, :]).to(self.device)
-                    mask_Y = copy.deepcopy(masks[:, -self.pred_len:, :]).to(self.device)
+                    pred, sample_Y, mask_Y = self.forecast_batch(self.model, batch)
                     
                     with torch.cuda.amp.autocast():
 
-                        pred = self.model(sample_X, mask_X, self.mpl)
-                        
-                        if self.n2one_ft==True:
-                            sample_Y = sample_Y[:, :, self.utils.target_index].unsqueeze(2)
-                        
                         loss, masked_loss, unmasked_loss = self.model.forward_loss(data=sample_Y, 
                                                                                    pred=pred, 
                                                                                    miss_idx=mask_Y, 
@@ -579,7 +637,7 @@ class Trainer():
         for it, (samples, masks) in tqdm(enumerate(dataloader)):
             
             samples = samples.to(self.device)
-            masks = masks.to(self.device)
+            masks = masks.to(self.device).float()
             
             with torch.cuda.amp.autocast():
                 pred, mask, nask = model(samples, masks, self.mpl)
@@ -636,19 +694,9 @@ class Trainer():
         batch_loss = 0
         og_masks_list = []
         
-        for it, (samples, masks) in tqdm(enumerate(dataloader)):
+        for it, batch in tqdm(enumerate(dataloader)):
             
-            sample_X = copy.deepcopy(samples[:, :self.seq_len, :]).to(self.device)
-            sample_Y = copy.deepcopy(samples[:, -self.pred_len:, :]).to(self.device)
-
-            mask_X = copy.deepcopy(masks[:, :self.seq_len, :]).to(self.device)
-            mask_Y = copy.deepcopy(masks[:, -self.pred_len:, :]).to(self.device)
-
-            with torch.cuda.amp.autocast():
-                pred = model(sample_X, mask_X, self.mpl)
-                
-                if self.n2one_ft==True:
-                    sample_Y = sample_Y[:, :, self.utils.target_index].unsqueeze(2)
+            pred, sample_Y, mask_Y = self.forecast_batch(model, batch)
             
             loss, _, _ = model.forward_loss(data=sample_Y, 
                                                  pred=pred, 
@@ -661,8 +709,7 @@ class Trainer():
 
             loss_value = loss.item()
             batch_loss += loss_value
-            del sample_X, sample_Y
-            del mask_X, mask_Y
+            del sample_Y, mask_Y
         
         val_X = torch.cat(samples_list, dim=0)
         predictions = torch.cat(preds_list, dim=0)
@@ -722,32 +769,21 @@ class Trainer():
 
         model.eval()
         with torch.no_grad():
-            for it, (samples, masks) in tqdm(enumerate(self.test_dataloader)):
+            for it, batch in tqdm(enumerate(self.test_dataloader)):
             
-                sample_X = copy.deepcopy(samples[:, :self.seq_len, :]).to(self.device)
-                sample_Y = copy.deepcopy(samples[:, -self.pred_len:, :]).to(self.device)
-
-                mask_X = copy.deepcopy(masks[:, :self.seq_len, :]).to(self.device)
-                mask_Y = copy.deepcopy(masks[:, -self.pred_len:, :]).to(self.device)
-
-                with torch.cuda.amp.autocast():
-                    pred = model(sample_X, mask_X, self.mpl)
-                    
-                    if self.n2one_ft==True:
-                        sample_Y = sample_Y[:, :, self.utils.target_index].unsqueeze(2)
+                pred, sample_Y, mask_Y = self.forecast_batch(model, batch)
                 
                 preds_list.append(pred.detach())
                     
-                del sample_X, sample_Y
-                del mask_X, mask_Y
+                del sample_Y, mask_Y
             
         for it, (samples, masks) in tqdm(enumerate(gt_test_dataloader)):
             
-            sample_X = copy.deepcopy(samples[:, :self.seq_len, :]).to(self.device)
-            sample_Y = copy.deepcopy(samples[:, -self.pred_len:, :]).to(self.device)
+            sample_X = samples[:, :self.seq_len, :]
+            sample_Y = samples[:, -self.pred_len:, :]
 
-            mask_X = copy.deepcopy(masks[:, :self.seq_len, :]).to(self.device)
-            mask_Y = copy.deepcopy(masks[:, -self.pred_len:, :]).to(self.device)
+            mask_X = masks[:, :self.seq_len, :].float()
+            mask_Y = masks[:, -self.pred_len:, :].float()
             
             if self.n2one_ft==True:
                 sample_Y = sample_Y[:, :, self.utils.target_index].unsqueeze(2)
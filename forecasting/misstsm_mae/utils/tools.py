@@ -79,8 +79,12 @@ class EarlyStopping:
         torch.save(model, path + '/' + 'checkpoint.pth')
         self.val_loss_min = val_loss
         
-def transfer_weights(weights_path, model, exclude_head=True, device='cpu'):
-    new_state_dict = torch.load(weights_path,  map_location=device).state_dict()
+def transfer_weights(weights_path, model, exclude_head=True, device='cpu', state_dict=None):
+    '''
+    copies the matching weights of the model saved at weights_path, or of state_dict when given
+    (one pretrained model loaded once and transferred to several models)
+    '''
+    new_state_dict = state_dict if state_dict is not None else torch.load(weights_path,  map_location=device).state_dict()
     
     matched_layers = 0
     unmatched_layers = []
@@ -5,12 +5,14 @@ import math
 import argparse
 import wandb
 import matplotlib.pyplot as plt
-import pickle
 
 from torch import nn as nn
 from torch.utils.data import Dataset, DataLoader
 from tqdm import tqdm
 
+from misstsm import TFI as FeatEmbed, apply_blocks, get_2d_pos_embed, single_query_attention
+from misstsm.windows import WindowBatches, rewindow, window_view, windows_to
+
 
 class MaskEmbed(nn.Module):
     """ record to mask embedding
@@ -29,25 +31,6 @@ class MaskEmbed(nn.Module):
         x = self.norm(x)
         return x
 
-class FeatEmbed(nn.Module):
-    """
-    Embed each feature
-    """
-    def __init__(self, input_dim=8, embedding_dim=8, norm_layer=None):
-        super().__init__()
-        self.embeddings = nn.ModuleList([
-            nn.Sequential(
-                nn.Linear(1, embedding_dim),
-                nn.LayerNorm(embedding_dim)
-            )
-            for _ in range(input_dim)
-        ])
-
-    def forward(self, x):
-        embedded_features = [emb_layer(x[:, :, i].unsqueeze(-1)) for i, emb_layer in enumerate(self.embeddings)]
-        embedded_features = torch.stack(embedded_features, dim=2)
-        return embedded_features
-
 class ActiveEmbed(nn.Module):
     """ 
     record to mask embedding
@@ -159,8 +142,11 @@ class NativeScaler:
 
 
 class MAEDataset(Dataset):
-
-    def __init__(self, X, M):
+    """
+    windows X [N, W, C], possibly a strided view (see window_view), with the missing values as nan:
+    item idx is the zero-filled window and its observed-value mask, taken from M when given
+    """
+    def __init__(self, X, M=None):
         self.X = X
         self.M = M
 
@@ -168,7 +154,30 @@ class MAEDataset(Dataset):
         return len(self.X)
 
     def __getitem__(self, idx: int):
-        return self.X[idx], self.M[idx]
+        x = self.X[idx]
+        if self.M is None:
+            return torch.nan_to_num(x), ~torch.isnan(x)
+        return x, self.M[idx]
+
+
+class LatentDataset(Dataset):
+    """
+    cached encoder outputs for training a forecasting head: item idx is the latent and the RevIN
+    means and std of the input part of window idx of X, and its zero-filled target and mask
+    """
+    def __init__(self, latents, means, std, X, pred_len):
+        self.latents = latents
+        self.means = means
+        self.std = std
+        self.X = X
+        self.pred_len = pred_len
+
+    def __len__(self):
+        return len(self.X)
+
+    def __getitem__(self, idx: int):
+        y = self.X[idx][-self.pred_len:]
+        return self.latents[idx], self.means[idx], self.std[idx], torch.nan_to_num(y), ~torch.isnan(y)
 
 
 class Utils:
@@ -194,13 +203,6 @@ class Utils:
         
         self.target_index = -1
     
-    def load_pickle(self, path):
-        
-        with open(path, 'rb') as pickle_file:
-            arr = pickle.load(pickle_file)
-        
-        return arr
-        
     def split_data(self, df, ratios):
         '''
         For ETT we follow 6:2:2 ratio, and for other datasets, it is usually. 7:1:1
@@ -229,9 +231,11 @@ class Utils:
         use this when working on masked data
         '''
         if not use_stat:
-            self.feat_mean = tensor.nanmean(dim=(0, 1))[None, None, :]
-            mask = torch.isnan(tensor)
-            filtered_data = tensor.clone()
+            # statistics of the input columns only, time features are left as they are
+            tensor_cols = tensor[:, :, :len(self.inp_cols)]
+            self.feat_mean = tensor_cols.nanmean(dim=(0, 1))[None, None, :]
+            mask = torch.isnan(tensor_cols)
+            filtered_data = tensor_cols.clone()
             filtered_data[mask] = 0
             
             rev_mask = 1-(mask*1)
@@ -272,30 +276,8 @@ class Utils:
 
         return X_train_torch, Y_train_torch, X_test_torch, Y_test_torch
     
-    def perform_windowing(self, df, path, name, split='train'):
-        
-        filename=name + '_' + split + '_' + str(self.pre_train_window) +'.pkl'
-        save_path=os.path.join(path, filename)
-        
-        if os.path.exists(save_path):
-            print("Window dataset already exists")
-            X = self.load_pickle(save_path)
-            return X
-        
-        else:
-            L = df.shape[0]
-            num_samples = (L - self.pre_train_window) // self.stride + 1
-            
-            X = []
-            
-            for ii in tqdm(np.arange(num_samples)):
-                start_x = self.stride * ii
-                end_x = start_x + self.pre_train_window
-
-                subset_df = df.iloc[start_x:end_x, :].copy(deep=True)
-                
-                X.append(np.expand_dims(subset_df, axis=0))
-
-            X = np.concatenate(X, axis=0)
-            
-            return X
\ No newline at end of file
+    def perform_windowing(self, series):
+        '''
+        [T, C] series tensor -> [num_windows, pre_train_window, C] strided view of its windows
+        '''
+        return window_view(series, self.pre_train_window, self.stride)
@@ -1,11 +1,14 @@
 import os
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 import os
 import torch
 from torch.utils.data import Dataset, DataLoader
 from sklearn.preprocessing import StandardScaler
-from utils.timefeatures import time_features
+from misstsm.timefeatures import time_features, calendar_features
+from misstsm.data_cache import cached, cached_stream, from_storage, load_scaler, scaler_stats, stored_series, stream_series
+from misstsm.data_source import read_columns, read_table
 import warnings
 
 warnings.filterwarnings('ignore')
@@ -14,7 +17,8 @@ warnings.filterwarnings('ignore')
 class Dataset_ETT_hour(Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTh1.csv',
-                 target='OT', scale=True, timeenc=0, freq='h'):
+                 target='OT', scale=True, timeenc=0, freq='h', cache_dir='', chunk_rows=0,
+                 storage_dtype='float32'):
         # size [seq_len, label_len, pred_len]
         # info
         if size == None:
@@ -38,17 +42,38 @@ class Dataset_ETT_hour(Dataset):
 
         self.root_path = root_path
         self.data_path = data_path
+        self.cache_dir = cache_dir
+        self.chunk_rows = chunk_rows
+        self.storage_dtype = storage_dtype
         self.__read_data__()
 
     def __read_data__(self):
-        self.scaler = StandardScaler()
-        df_raw = pd.read_csv(os.path.join(self.root_path,
-                                          self.data_path))
-
-        border1s = [0, 12 * 30 * 24 - self.seq_len, 12 * 30 * 24 + 4 * 30 * 24 - self.seq_len]
-        border2s = [12 * 30 * 24, 12 * 30 * 24 + 4 * 30 * 24, 12 * 30 * 24 + 8 * 30 * 24]
-        border1 = border1s[self.set_type]
-        border2 = border2s[self.set_type]
+        params = dict(dataset=type(self).__name__, seq_len=self.seq_len, features=self.features,
+                      target=self.target, scale=self.scale, timeenc=self.timeenc, freq=self.freq,
+                      storage_dtype=self.storage_dtype)
+        path = os.path.join(self.root_path, self.data_path)
+        if self.chunk_rows:
+            meta, arrays = cached_stream(self.cache_dir, path, params, self.__stream_data__)
+        else:
+            meta, arrays = cached(self.cache_dir, path, params, self.__parse_data__)
+        border1 = meta['border1s'][self.set_type]
+        border2 = meta['border2s'][self.set_type]
+        self.scaler = load_scaler(meta['scaler'])
+
+        # zero-filled values and observed-value mask of the split, views of the parsed (or cached) arrays
+        self.data_x = arrays['data'][border1:border2]
+        self.data_y = self.data_x
+        self.mask_x = arrays['mask'][border1:border2]
+        self.mask_y = self.mask_x
+        self.data_stamp = arrays['stamp'][border1:border2]
+
+    def __parse_data__(self):
+        scaler = StandardScaler()
+        path = os.path.join(self.root_path, self.data_path)
+        # a univariate run reads only the date and target columns
+        df_raw = read_table(path, ['date', self.target] if self.features == 'S' else None)
+
+        border1s, border2s = self.__borders__(len(df_raw))
 
         if self.features == 'M' or self.features == 'MS':
             cols_data = df_raw.columns[1:]
@@ -58,26 +83,37 @@ class Dataset_ETT_hour(Dataset):
 
         if self.scale:
             train_data = df_data[border1s[0]:border2s[0]]
-            self.scaler.fit(train_data.values)
-            data = self.scaler.transform(df_data.values)
+            scaler.fit(train_data.values)
+            data = scaler.transform(df_data.values)
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
+        df_stamp = df_raw[['date']]
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            data_stamp = df_stamp.drop(['date'], axis=1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        meta = {'border1s': border1s, 'border2s': border2s,
+                'scaler': scaler_stats(scaler) if self.scale else None}
+        arrays = dict(stored_series(data, self.storage_dtype), stamp=data_stamp.astype(np.float32))
+        return meta, arrays
+
+    def __borders__(self, num_rows):
+        border1s = [0, 12 * 30 * 24 - self.seq_len, 12 * 30 * 24 + 4 * 30 * 24 - self.seq_len]
+        border2s = [12 * 30 * 24, 12 * 30 * 24 + 4 * 30 * 24, 12 * 30 * 24 + 8 * 30 * 24]
+        return border1s, border2s
+
+    def __stream_data__(self, entry):
+        path = os.path.join(self.root_path, self.data_path)
+        if self.features == 'M' or self.features == 'MS':
+            data_cols = read_columns(path)[1:]
+        elif self.features == 'S':
+            data_cols = [self.target]
+        return stream_series(entry, path, data_cols, self.__borders__, self.scale, self.timeenc, self.freq,
+                             self.storage_dtype, ('month', 'day', 'weekday', 'hour'), self.chunk_rows)
 
     def __getitem__(self, index):
         s_begin = index
@@ -85,19 +121,12 @@ class Dataset_ETT_hour(Dataset):
         r_begin = s_end - self.label_len
         r_end = r_begin + self.label_len + self.pred_len
 
-        seq_x = self.data_x[s_begin:s_end]
-        seq_y = self.data_y[r_begin:r_end]
+        seq_x = from_storage(self.data_x[s_begin:s_end])
+        seq_y = from_storage(self.data_y[r_begin:r_end])
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-        
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-        
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
@@ -111,7 +140,8 @@ class Dataset_ETT_hour(Dataset):
 class Dataset_ETT_minute(Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTm1.csv',
-                 target='OT', scale=True, timeenc=0, freq='t'):
+                 target='OT', scale=True, timeenc=0, freq='t', cache_dir='', chunk_rows=0,
+                 storage_dtype='float32'):
         # size [seq_len, label_len, pred_len]
         # info
         if size == None:
@@ -135,17 +165,38 @@ class Dataset_ETT_minute(Dataset):
 
         self.root_path = root_path
         self.data_path = data_path
+        self.cache_dir = cache_dir
+        self.chunk_rows = chunk_rows
+        self.storage_dtype = storage_dtype
         self.__read_data__()
 
     def __read_data__(self):
-        self.scaler = StandardScaler()
-        df_raw = pd.read_csv(os.path.join(self.root_path,
-                                          self.data_path))
-
-        border1s = [0, 12 * 30 * 24 * 4 - self.seq_len, 12 * 30 * 24 * 4 + 4 * 30 * 24 * 4 - self.seq_len]
-        border2s = [12 * 30 * 24 * 4, 12 * 30 * 24 * 4 + 4 * 30 * 24 * 4, 12 * 30 * 24 * 4 + 8 * 30 * 24 * 4]
-        border1 = border1s[self.set_type]
-        border2 = border2s[self.set_type]
+        params = dict(dataset=type(self).__name__, seq_len=self.seq_len, features=self.features,
+                      target=self.target, scale=self.scale, timeenc=self.timeenc, freq=self.freq,
+                      storage_dtype=self.storage_dtype)
+        path = os.path.join(self.root_path, self.data_path)
+        if self.chunk_rows:
+            meta, arrays = cached_stream(self.cache_dir, path, params, self.__stream_data__)
+        else:
+            meta, arrays = cached(self.cache_dir, path, params, self.__parse_data__)
+        border1 = meta['border1s'][self.set_type]
+        border2 = meta['border2s'][self.set_type]
+        self.scaler = load_scaler(meta['scaler'])
+
+        # zero-filled values and observed-value mask of the split, views of the parsed (or cached) arrays
+        self.data_x = arrays['data'][border1:border2]
+        self.data_y = self.data_x
+        self.mask_x = arrays['mask'][border1:border2]
+        self.mask_y = self.mask_x
+        self.data_stamp = arrays['stamp'][border1:border2]
+
+    def __parse_data__(self):
+        scaler = StandardScaler()
+        path = os.path.join(self.root_path, self.data_path)
+        # a univariate run reads only the date and target columns
+        df_raw = read_table(path, ['date', self.target] if self.features == 'S' else None)
+
+        border1s, border2s = self.__borders__(len(df_raw))
 
         if self.features == 'M' or self.features == 'MS':
             cols_data = df_raw.columns[1:]
@@ -155,28 +206,37 @@ class Dataset_ETT_minute(Dataset):
 
         if self.scale:
             train_data = df_data[border1s[0]:border2s[0]]
-            self.scaler.fit(train_data.values)
-            data = self.scaler.transform(df_data.values)
+            scaler.fit(train_data.values)
+            data = scaler.transform(df_data.values)
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
+        df_stamp = df_raw[['date']]
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], axis=1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour', 'minute'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        meta = {'border1s': border1s, 'border2s': border2s,
+                'scaler': scaler_stats(scaler) if self.scale else None}
+        arrays = dict(stored_series(data, self.storage_dtype), stamp=data_stamp.astype(np.float32))
+        return meta, arrays
+
+    def __borders__(self, num_rows):
+        border1s = [0, 12 * 30 * 24 * 4 - self.seq_len, 12 * 30 * 24 * 4 + 4 * 30 * 24 * 4 - self.seq_len]
+        border2s = [12 * 30 * 24 * 4, 12 * 30 * 24 * 4 + 4 * 30 * 24 * 4, 12 * 30 * 24 * 4 + 8 * 30 * 24 * 4]
+        return border1s, border2s
+
+    def __stream_data__(self, entry):
+        path = os.path.join(self.root_path, self.data_path)
+        if self.features == 'M' or self.features == 'MS':
+            data_cols = read_columns(path)[1:]
+        elif self.features == 'S':
+            data_cols = [self.target]
+        return stream_series(entry, path, data_cols, self.__borders__, self.scale, self.timeenc, self.freq,
+                             self.storage_dtype, ('month', 'day', 'weekday', 'hour', 'minute'), self.chunk_rows)
 
     def __getitem__(self, index):
         s_begin = index
@@ -184,19 +244,12 @@ class Dataset_ETT_minute(Dataset):
         r_begin = s_end - self.label_len
         r_end = r_begin + self.label_len + self.pred_len
 
-        seq_x = self.data_x[s_begin:s_end]
-        seq_y = self.data_y[r_begin:r_end]
+        seq_x = from_storage(self.data_x[s_begin:s_end])
+        seq_y = from_storage(self.data_y[r_begin:r_end])
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
@@ -210,7 +263,8 @@ class Dataset_ETT_minute(Dataset):
 class Dataset_Custom(Dataset):
     def __init__(self, root_path, flag='train', size=None,
                  features='S', data_path='ETTh1.csv',
-                 target='OT', scale=True, timeenc=0, freq='h'):
+                 target='OT', scale=True, timeenc=0, freq='h', cache_dir='', chunk_rows=0,
+                 storage_dtype='float32'):
         # size [seq_len, label_len, pred_len]
         # info
         if size == None:
@@ -234,28 +288,46 @@ class Dataset_Custom(Dataset):
 
         self.root_path = root_path
         self.data_path = data_path
+        self.cache_dir = cache_dir
+        self.chunk_rows = chunk_rows
+        self.storage_dtype = storage_dtype
         self.__read_data__()
 
     def __read_data__(self):
-        self.scaler = StandardScaler()
-        df_raw = pd.read_csv(os.path.join(self.root_path,
-                                          self.data_path))
+        params = dict(dataset=type(self).__name__, seq_len=self.seq_len, features=self.features,
+                      target=self.target, scale=self.scale, timeenc=self.timeenc, freq=self.freq,
+                      storage_dtype=self.storage_dtype)
+        path = os.path.join(self.root_path, self.data_path)
+        if self.chunk_rows:
+            meta, arrays = cached_stream(self.cache_dir, path, params, self.__stream_data__)
+        else:
+            meta, arrays = cached(self.cache_dir, path, params, self.__parse_data__)
+        border1 = meta['border1s'][self.set_type]
+        border2 = meta['border2s'][self.set_type]
+        self.scaler = load_scaler(meta['scaler'])
+
+        # zero-filled values and observed-value mask of the split, views of the parsed (or cached) arrays
+        self.data_x = arrays['data'][border1:border2]
+        self.data_y = self.data_x
+        self.mask_x = arrays['mask'][border1:border2]
+        self.mask_y = self.mask_x
+        self.data_stamp = arrays['stamp'][border1:border2]
+
+    def __parse_data__(self):
+        scaler = StandardScaler()
+        path = os.path.join(self.root_path, self.data_path)
 
         '''
         df_raw.columns: ['date', ...(other features), target feature]
         '''
-        cols = list(df_raw.columns)
+        cols = read_columns(path)
         cols.remove(self.target)
         cols.remove('date')
-        df_raw = df_raw[['date'] + cols + [self.target]]
+        if self.features == 'S':
+            cols = []
+        df_raw = read_table(path, ['date'] + cols + [self.target])
         # print(cols)
-        num_train = int(len(df_raw) * 0.7)
-        num_test = int(len(df_raw) * 0.2)
-        num_vali = len(df_raw) - num_train - num_test
-        border1s = [0, num_train - self.seq_len, len(df_raw) - num_test - self.seq_len]
-        border2s = [num_train, num_train + num_vali, len(df_raw)]
-        border1 = border1s[self.set_type]
-        border2 = border2s[self.set_type]
+        border1s, border2s = self.__borders__(len(df_raw))
 
         if self.features == 'M' or self.features == 'MS':
             cols_data = df_raw.columns[1:]
@@ -265,24 +337,42 @@ class Dataset_Custom(Dataset):
 
         if self.scale:
             train_data = df_data[border1s[0]:border2s[0]]
-            self.scaler.fit(train_data.values)
+            scaler.fit(train_data.values)
             # print(self.scaler.mean_)
             # exit()
-            data = self.scaler.transform(df_data.values)
+            data = scaler.transform(df_data.values)
         else:
             data = df_data.values
 
-        df_stamp = df_raw[['date']][border1:border2]
+        df_stamp = df_raw[['date']]
         df_stamp['date'] = pd.to_datetime(df_stamp.date)
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
+            data_stamp = calendar_features(df_stamp.date, ('month',))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
 
-        self.data_x = data[border1:border2]
-        self.data_y = data[border1:border2]
-        self.data_stamp = data_stamp
+        meta = {'border1s': border1s, 'border2s': border2s,
+                'scaler': scaler_stats(scaler) if self.scale else None}
+        arrays = dict(stored_series(data, self.storage_dtype), stamp=data_stamp.astype(np.float32))
+        return meta, arrays
+
+    def __borders__(self, num_rows):
+        num_train = int(num_rows * 0.7)
+        num_test = int(num_rows * 0.2)
+        num_vali = num_rows - num_train - num_test
+        border1s = [0, num_train - self.seq_len, num_rows - num_test - self.seq_len]
+        border2s = [num_train, num_train + num_vali, num_rows]
+        return border1s, border2s
+
+    def __stream_data__(self, entry):
+        path = os.path.join(self.root_path, self.data_path)
+        cols = read_columns(path)
+        cols.remove(self.target)
+        cols.remove('date')
+        data_cols = [self.target] if self.features == 'S' else cols + [self.target]
+        return stream_series(entry, path, data_cols, self.__borders__, self.scale, self.timeenc, self.freq,
+                             self.storage_dtype, ('month',), self.chunk_rows)
 
     def __getitem__(self, index):
         s_begin = index
@@ -290,19 +380,12 @@ class Dataset_Custom(Dataset):
         r_begin = s_end - self.label_len
         r_end = r_begin + self.label_len + self.pred_len
 
-        seq_x = self.data_x[s_begin:s_end]
-        seq_y = self.data_y[r_begin:r_end]
+        seq_x = from_storage(self.data_x[s_begin:s_end])
+        seq_y = from_storage(self.data_y[r_begin:r_end])
         seq_x_mark = self.data_stamp[s_begin:s_end]
         seq_y_mark = self.data_stamp[r_begin:r_end]
-
-        maskX = np.isnan(seq_x).astype(int)
-        maskX = 1 - maskX
-
-        maskY = np.isnan(seq_y).astype(int)
-        maskY = 1 - maskY
-
-        seq_x = np.nan_to_num(seq_x)
-        seq_y = np.nan_to_num(seq_y)
+        maskX = self.mask_x[s_begin:s_end]
+        maskY = self.mask_y[r_begin:r_end]
 
         return seq_x, seq_y, seq_x_mark, seq_y_mark, maskX, maskY
 
@@ -378,13 +461,7 @@ class Dataset_Pred(Dataset):
         df_stamp = pd.DataFrame(columns=['date'])
         df_stamp.date = list(tmp_stamp.date.values) + list(pred_dates[1:])
         if self.timeenc == 0:
-            df_stamp['month'] = df_stamp.date.apply(lambda row: row.month, 1)
-            df_stamp['day'] = df_stamp.date.apply(lambda row: row.day, 1)
-            df_stamp['weekday'] = df_stamp.date.apply(lambda row: row.weekday(), 1)
-            df_stamp['hour'] = df_stamp.date.apply(lambda row: row.hour, 1)
-            df_stamp['minute'] = df_stamp.date.apply(lambda row: row.minute, 1)
-            df_stamp['minute'] = df_stamp.minute.map(lambda x: x // 15)
-            data_stamp = df_stamp.drop(['date'], axis=1).values
+            data_stamp = calendar_features(df_stamp.date, ('month', 'day', 'weekday', 'hour', 'minute'))
         elif self.timeenc == 1:
             data_stamp = time_features(pd.to_datetime(df_stamp['date'].values), freq=self.freq)
             data_stamp = data_stamp.transpose(1, 0)
@@ -417,3 +494,68 @@ class Dataset_Pred(Dataset):
 
     def inverse_transform(self, data):
         return self.scaler.inverse_transform(data)
+
+
+class BatchedWindows(Dataset):
+    """
+    Whole-batch view of a windowed dataset (one with precomputed masks): item `indices` is the
+    batch of windows starting at those indices, gathered from strided window views with one
+    fancy-indexing operation per array instead of one __getitem__ per window and a collate.
+    Use with a BatchSampler and batch_size=None
+    """
+    def __init__(self, dataset):
+        self.dataset = dataset
+        seq_len, y_len = dataset.seq_len, dataset.label_len + dataset.pred_len
+        self.y_shift = dataset.seq_len - dataset.label_len
+        # [num_windows, num_columns, window_len] views of the split, nothing is copied
+        self.x = sliding_window_view(dataset.data_x, seq_len, axis=0)
+        self.y = sliding_window_view(dataset.data_y, y_len, axis=0)
+        self.x_mark = sliding_window_view(dataset.data_stamp, seq_len, axis=0)
+        self.y_mark = sliding_window_view(dataset.data_stamp, y_len, axis=0)
+        self.mask_x = sliding_window_view(dataset.mask_x, seq_len, axis=0)
+        self.mask_y = sliding_window_view(dataset.mask_y, y_len, axis=0)
+
+    def __getitem__(self, indices):
+        s_begin = np.asarray(indices)
+        r_begin = s_begin + self.y_shift
+
+        return from_storage(gather(self.x, s_begin)), from_storage(gather(self.y, r_begin)), \
+            gather(self.x_mark, s_begin), gather(self.y_mark, r_begin), \
+            gather(self.mask_x, s_begin), gather(self.mask_y, r_begin)
+
+    def values(self, indices):
+        """
+        seq_x and seq_y of the batch only
+        """
+        s_begin = np.asarray(indices)
+        return from_storage(gather(self.x, s_begin)), from_storage(gather(self.y, s_begin + self.y_shift))
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+def gather(windows, index):
+    # [num_windows, num_columns, window_len] views -> contiguous [batch, window_len, num_columns]
+    return np.ascontiguousarray(windows[index].transpose(0, 2, 1))
+
+
+class MaskedGroundTruth(Dataset):
+    """
+    A masked dataset and its ground-truth counterpart (same windows of the file without missing
+    values) read with one index: item `index` is the masked item followed by the ground-truth
+    seq_x and seq_y. Wraps per-window datasets or two BatchedWindows
+    """
+    def __init__(self, dataset, gt_dataset):
+        assert len(dataset) == len(gt_dataset), 'masked and ground-truth data have different lengths'
+        self.dataset = dataset
+        self.gt_dataset = gt_dataset
+
+    def __getitem__(self, index):
+        if isinstance(self.gt_dataset, BatchedWindows):
+            gt_x, gt_y = self.gt_dataset.values(index)
+        else:
+            gt_x, gt_y = self.gt_dataset[index][:2]
+        return tuple(self.dataset[index]) + (gt_x, gt_y)
+
+    def __len__(self):
+        return len(self.dataset)
@@ -1,4 +1,4 @@
-from data_provider.data_factory import data_provider
+from data_provider.data_factory import data_provider, masked_gt_provider
 from exp.exp_basic import Exp_Basic
 from models import Informer, Autoformer, Transformer, DLinear, Linear, NLinear, PatchTST
 from utils.tools import EarlyStopping, adjust_learning_rate, visual
@@ -43,6 +43,10 @@ class Exp_Main(Exp_Basic):
         data_set, data_loader = data_provider(self.args, flag, gt)
         return data_set, data_loader
 
+    def _get_masked_gt_data(self, flag):
+        data_set, gt_set, data_loader = masked_gt_provider(self.args, flag)
+        return data_set, gt_set, data_loader
+
     def _select_optimizer(self):
         model_optim = optim.Adam(self.model.parameters(), lr=self.args.learning_rate)
         return model_optim
@@ -62,8 +66,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -156,8 +160,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
                 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -286,8 +290,8 @@ class Exp_Main(Exp_Basic):
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -378,8 +382,8 @@ class Exp_Main(Exp_Basic):
         return
     
     def test_masked(self, setting, test=0):
-        test_data, test_loader = self._get_data(flag='test')
-        test_data_gt, test_loader_gt = self._get_data(flag='test', gt=True)
+        # masked inputs and ground-truth targets of the same windows in one pass
+        test_data, test_data_gt, test_loader = self._get_masked_gt_data(flag='test')
 
         if test:
             print('loading model')
@@ -400,15 +404,15 @@ class Exp_Main(Exp_Basic):
 
         self.model.eval()
         with torch.no_grad():
-            for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, batch_mask_x, batch_mask_y) in enumerate(test_loader):
+            for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, batch_mask_x, batch_mask_y, gt_x, gt_y) in enumerate(test_loader):
                 batch_x = batch_x.float().to(self.device)
                 batch_y = batch_y.float().to(self.device)
 
                 batch_x_mark = batch_x_mark.float().to(self.device)
                 batch_y_mark = batch_y_mark.float().to(self.device)
 
-                batch_mask_x = batch_mask_x.float().to(self.device)
-                batch_mask_y = batch_mask_y.float().to(self.device)
+                batch_mask_x = batch_mask_x.to(self.device).float()
+                batch_mask_y = batch_mask_y.to(self.device).float()
 
                 # decoder input
                 dec_inp = torch.zeros_like(batch_y[:, -self.args.pred_len:, :]).float()
@@ -452,27 +456,22 @@ class Exp_Main(Exp_Basic):
                 inputx.append(batch_x.detach().cpu().numpy())
                 masks_y.append(mask_y)
                 masks_x.append(mask_x)
-            
-            for i, (batch_x, batch_y, batch_x_mark, batch_y_mark, _, _) in enumerate(test_loader_gt):
-                
-                f_dim = -1 if self.args.features == 'MS' else 0
-                batch_y = batch_y[:, -self.args.pred_len:, f_dim:].to(self.device)
-                true = batch_y.detach().cpu().numpy()
-                
+
+                true = gt_y[:, -self.args.pred_len:, f_dim:].numpy()
                 trues.append(true)
 
                 if i % 10 == 0:
-                    input = batch_x.detach().cpu().numpy()
+                    input = gt_x.numpy()
                     gt = true[0, :, -1]
                     
                     pd = preds[i][0, :, -1]
                     full_mask = masks_x[i][0, :, -1]
                     
-                    inputx = input[0, :, -1]
-                    inputx[full_mask == 0] = np.nan
+                    input_x = input[0, :, -1]
+                    input_x[full_mask == 0] = np.nan
 
-                    gt = np.concatenate((inputx, gt), axis=0)
-                    pd = np.concatenate((inputx, pd), axis=0)
+                    gt = np.concatenate((input_x, gt), axis=0)
+                    pd = np.concatenate((input_x, pd), axis=0)
                     
                     visual(true=gt, 
                            preds=pd, 
@@ -60,7 +60,12 @@ class Model(nn.Module):
                                         num_feats=c_in,
                                         embed=configs.mtsm_embed,
                                         mtsm_norm=configs.mtsm_norm,
-                                        layernorm=configs.layernorm)
+                                        layernorm=configs.layernorm,
+                                        observed_only=configs.observed_only,
+                                        chunk_size=configs.mtsm_chunk_size,
+                                        use_checkpoint=configs.mtsm_checkpoint,
+                                        num_queries=configs.mtsm_queries,
+                                        kv_groups=configs.mtsm_kv_groups or None)
             else:
                 self.MTSMLayer = MissTSM(q_dim=configs.q_dim,
                                         k_dim=configs.k_dim, 
@@ -68,7 +73,12 @@ class Model(nn.Module):
                                         num_feats=c_in,
                                         embed=configs.mtsm_embed,
                                         mtsm_norm=configs.mtsm_norm,
-                                        layernorm=configs.layernorm)
+                                        layernorm=configs.layernorm,
+                                        observed_only=configs.observed_only,
+                                        chunk_size=configs.mtsm_chunk_size,
+                                        use_checkpoint=configs.mtsm_checkpoint,
+                                        num_queries=configs.mtsm_queries,
+                                        kv_groups=configs.mtsm_kv_groups or None)
         # model
         self.decomposition = decomposition
         if self.decomposition:
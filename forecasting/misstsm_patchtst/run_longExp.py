@@ -1,5 +1,7 @@
 import argparse
 import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
 import torch
 from exp.exp_main import Exp_Main
 import random
@@ -21,7 +23,7 @@ parser.add_argument('--model', type=str, required=True, default='Autoformer',
 # data loader
 parser.add_argument('--data', type=str, required=True, default='ETTm1', help='dataset type')
 parser.add_argument('--root_path', type=str, default='./datasets', help='root path of the data file')
-parser.add_argument('--data_path', type=str, default='ETTh1.csv', help='data file')
+parser.add_argument('--data_path', type=str, default='ETTh1.csv', help='data file: csv, parquet or feather')
 
 parser.add_argument('--gt_root_path', type=str, default='', help='root path of the ground-truth file')
 parser.add_argument('--gt_data_path', type=str, default='', help='gt data file')
@@ -66,6 +68,11 @@ parser.add_argument('--layernorm', type=int, default=1, help='whether to apply l
 parser.add_argument('--mtsm_norm', type=int, default=1, help='perform denorm misstsm')
 parser.add_argument('--mtsm_embed', type=str, default="linear", help='type of TFI embedding to apply')
 parser.add_argument('--skip_connection', type=int, default=0, help='add skipconnection to misstsm')
+parser.add_argument('--observed_only', type=int, default=0, help='embed only the observed values, the missing (zero-filled) ones share one embedding per sample and feature; same output as the dense path')
+parser.add_argument('--mtsm_chunk_size', type=int, default=0, help='process the misstsm layer this many timesteps at a time, 0 for all at once')
+parser.add_argument('--mtsm_checkpoint', type=int, default=0, help='recompute misstsm activations in backward instead of storing them')
+parser.add_argument('--mtsm_queries', type=int, default=1, help='number of learned misstsm queries per timestep')
+parser.add_argument('--mtsm_kv_groups', type=int, default=0, help='key/value groups shared by the misstsm heads (grouped-query attention), 0 for nn.MultiheadAttention')
 
 # Formers 
 parser.add_argument('--embed_type', type=int, default=0, help='0: default 1: value embedding + temporal embedding + positional embedding 2: value embedding + temporal embedding 3: value embedding + positional embedding 4: value embedding')
@@ -91,6 +98,10 @@ parser.add_argument('--do_predict', action='store_true', help='whether to predic
 
 # optimization
 parser.add_argument('--num_workers', type=int, default=10, help='data loader num workers')
+parser.add_argument('--batch_windows', type=int, default=1, help='gather each batch of windows in one indexing operation instead of per-window __getitem__')
+parser.add_argument('--data_cache_dir', type=str, default='', help='directory of the memory-mapped cache of parsed datasets (e.g. ./dataset_cache/), disabled when empty')
+parser.add_argument('--stream_chunk_rows', type=int, default=0, help='parse the data file into the dataset cache this many rows at a time (requires --data_cache_dir), for series larger than memory; 0 parses it whole')
+parser.add_argument('--storage_dtype', type=str, default='float32', choices=['float32', 'float16', 'bfloat16'], help='precision of the stored series values, widened to float32 per batch')
 parser.add_argument('--itr', type=int, default=2, help='experiments times')
 parser.add_argument('--train_epochs', type=int, default=100, help='train epochs')
 parser.add_argument('--batch_size', type=int, default=128, help='batch size of train input data')
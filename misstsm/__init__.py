@@ -0,0 +1,15 @@
+"""
+MissTSM layers shared by the forecasting (iTransformer, PatchTST, MAE) and classification models.
+
+The execution backend is process-wide: 'optimized' (default) or 'reference', the original
+implementation kept for verification. Select it with set_backend or the MISSTSM_BACKEND
+environment variable, and run `python -m misstsm.parity` to compare the two.
+
+The dataset readers (misstsm.data_source), the parsed dataset cache (misstsm.data_cache) and the
+time feature encodings (misstsm.timefeatures) are shared by the forecasting data loaders, the
+strided window views and batches (misstsm.windows) by the MAE.
+"""
+from misstsm.backend import BACKENDS, get_backend, set_backend
+from misstsm.attention import GroupedQueryAttention, segment_single_query_attention, single_query_attention
+from misstsm.embed import CachedPositionalEncoding2D, LinearEmbed, TFI, embed_observed, get_2d_pos_embed
+from misstsm.layers import MissTSM, MissTSMSkip, apply_blocks, chunked, iMissTSM
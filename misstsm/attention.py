@@ -0,0 +1,172 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from misstsm import reference
+from misstsm.backend import get_backend
+
+
+def _query_key_direction(query, mhca):
+    """
+    Fold the learned query into the key projection of mhca: q_h . (W_k x + b_k) only depends
+    on x through (W_k,h^T q_h) . x, the bias term shifts every logit of a row equally
+    returns: [H, d] (already scaled by 1/sqrt(head_dim))
+    """
+    d = mhca.embed_dim
+    num_heads = mhca.num_heads
+    head_dim = d // num_heads
+
+    w_q, w_k, _ = mhca.in_proj_weight.chunk(3)
+    b_q = mhca.in_proj_bias.chunk(3)[0] if mhca.in_proj_bias is not None else None
+
+    q = F.linear(query.reshape(-1), w_q, b_q).view(num_heads, head_dim) * head_dim ** -0.5
+    return torch.einsum('hc,hcd->hd', q, w_k.view(num_heads, head_dim, d))
+
+
+def _project_pooled(pooled, attn_sum, mhca):
+    """
+    Value and output projection of attention-pooled keys
+    pooled: [..., H, d], attn_sum: [..., H] total attention weight of every row (1 without dropout)
+    returns: [..., d]
+    """
+    d = mhca.embed_dim
+    num_heads = mhca.num_heads
+    head_dim = d // num_heads
+
+    w_v = mhca.in_proj_weight.chunk(3)[2]
+    out = torch.einsum('...hd,hcd->...hc', pooled, w_v.view(num_heads, head_dim, d))
+    if mhca.in_proj_bias is not None:
+        b_v = mhca.in_proj_bias.chunk(3)[2].view(num_heads, head_dim)
+        if attn_sum is not None:
+            out = out + attn_sum.unsqueeze(-1) * b_v
+        else:
+            out = out + b_v
+    out = out.reshape(*out.shape[:-2], d)
+
+    return F.linear(out, mhca.out_proj.weight, mhca.out_proj.bias)
+
+
+def single_query_attention(query, x, mhca, key_padding_mask=None):
+    """
+    One learned query attending over the second-to-last axis of x, using the weights of mhca.
+    Matches mhca(query, x, x, key_padding_mask=key_padding_mask) for every leading index of x
+    without repeating the query or projecting the keys: the query is folded into the key
+    projection and the values are projected after pooling.
+    x: [..., S, d], key_padding_mask: [..., S] (bool excludes, float is added to the logits)
+    returns: [..., d]
+    """
+    if get_backend() == 'reference':
+        return reference.query_attention(query, x, mhca, key_padding_mask=key_padding_mask)
+
+    scores = torch.matmul(x, _query_key_direction(query, mhca).t())  # [..., S, H]
+    if key_padding_mask is not None:
+        if key_padding_mask.dtype == torch.bool:
+            scores = scores.masked_fill(key_padding_mask.unsqueeze(-1), float('-inf'))
+        else:
+            scores = scores + key_padding_mask.unsqueeze(-1).to(scores.dtype)
+
+    attn = torch.softmax(scores, dim=-2)
+    attn = F.dropout(attn, p=mhca.dropout, training=mhca.training)
+
+    pooled = torch.matmul(attn.transpose(-1, -2), x)  # [..., H, d]
+    attn_sum = attn.sum(dim=-2) if mhca.training and mhca.dropout > 0 else None
+
+    return _project_pooled(pooled, attn_sum, mhca)
+
+
+def segment_single_query_attention(query, x, segment_ids, num_segments, mhca, bias=None):
+    """
+    single_query_attention over a packed (ragged) set of keys: row i of x belongs to segment
+    segment_ids[i] and the softmax runs within each segment. Equals the dense path with every
+    absent key excluded; empty segments pool nothing and return the projected value bias.
+    x: [K, d], segment_ids: [K] (int64, in [0, num_segments)), bias: [K] added to the logits (the
+    float key_padding_mask of the dense path)
+    returns: [num_segments, d]
+    """
+    d = x.shape[-1]
+    num_heads = mhca.num_heads
+
+    scores = torch.matmul(x, _query_key_direction(query, mhca).t())  # [K, H]
+    if bias is not None:
+        scores = scores + bias.unsqueeze(-1).to(scores.dtype)
+    index = segment_ids.unsqueeze(-1).expand_as(scores)
+    seg_max = scores.new_full((num_segments, num_heads), float('-inf'))
+    seg_max = seg_max.scatter_reduce(0, index, scores.detach(), reduce='amax')
+
+    weights = torch.exp(scores - seg_max[segment_ids])
+    seg_sum = scores.new_zeros(num_segments, num_heads).index_add(0, segment_ids, weights)
+    attn = weights / seg_sum[segment_ids]
+    attn = F.dropout(attn, p=mhca.dropout, training=mhca.training)
+
+    pooled = x.new_zeros(num_segments, num_heads, d)
+    pooled = pooled.index_add(0, segment_ids, attn.unsqueeze(-1) * x.unsqueeze(1))
+    if mhca.training and mhca.dropout > 0:
+        attn_sum = scores.new_zeros(num_segments, num_heads).index_add(0, segment_ids, attn)
+    else:
+        attn_sum = None
+
+    return _project_pooled(pooled, attn_sum, mhca)
+
+
+class GroupedQueryAttention(nn.Module):
+    """
+    num_queries learned queries attending over the keys of every row, with num_heads query heads
+    sharing num_kv_groups key/value projections (grouped-query attention)
+    """
+    def __init__(self, embed_dim, num_heads=1, num_kv_groups=1):
+        super().__init__()
+        assert embed_dim % num_heads == 0 and num_heads % num_kv_groups == 0
+        self.embed_dim = embed_dim
+        self.num_heads = num_heads
+        self.num_kv_groups = num_kv_groups
+        self.head_dim = embed_dim // num_heads
+
+        self.q_proj = nn.Linear(embed_dim, embed_dim)
+        self.kv_proj = nn.Linear(embed_dim, 2 * num_kv_groups * self.head_dim)
+        self.out_proj = nn.Linear(embed_dim, embed_dim)
+
+    def forward(self, query, x, key_padding_mask=None):
+        """
+        query: [1, Q, d], x: [..., S, d], key_padding_mask: [..., S] (bool excludes, float is added to the logits)
+        returns: [..., Q, d]
+        """
+        d, head_dim = self.embed_dim, self.head_dim
+        num_groups, group_size = self.num_kv_groups, self.num_heads // self.num_kv_groups
+        num_queries = query.shape[-2]
+
+        q = self.q_proj(query.reshape(num_queries, d)) * head_dim ** -0.5
+        q = q.view(num_queries, num_groups, group_size, head_dim)
+        w_k, w_v = self.kv_proj.weight.chunk(2)
+        b_k, b_v = self.kv_proj.bias.chunk(2)
+
+        # per key: folding the queries into the projections costs 2*Q*H*d, projecting the keys
+        # and values of every group first costs 2*G*head_dim*d + 2*Q*H*head_dim
+        fold = num_queries * self.num_heads * d <= num_groups * head_dim * d + num_queries * self.num_heads * head_dim
+
+        if fold:
+            k_dir = torch.einsum('qghc,gcd->qghd', q, w_k.view(num_groups, head_dim, d))
+            scores = torch.matmul(x, k_dir.reshape(-1, d).t())  # [..., S, Q*H]
+            mask = key_padding_mask.unsqueeze(-1) if key_padding_mask is not None else None
+        else:
+            k = F.linear(x, w_k, b_k).view(*x.shape[:-1], num_groups, head_dim).transpose(-2, -3)
+            q = q.permute(1, 3, 0, 2).reshape(num_groups, head_dim, num_queries * group_size)
+            scores = torch.matmul(k, q)  # [..., G, S, Q*H/G]
+            mask = key_padding_mask.unsqueeze(-2).unsqueeze(-1) if key_padding_mask is not None else None
+        if mask is not None:
+            if mask.dtype == torch.bool:
+                scores = scores.masked_fill(mask, float('-inf'))
+            else:
+                scores = scores + mask.to(scores.dtype)
+        attn = torch.softmax(scores, dim=-2)
+
+        if fold:
+            pooled = torch.matmul(attn.transpose(-1, -2), x)
+            pooled = pooled.view(*pooled.shape[:-2], num_queries, num_groups, group_size, d)
+            out = torch.einsum('...qghd,gcd->...qghc', pooled, w_v.view(num_groups, head_dim, d))
+            out = out + b_v.view(num_groups, 1, head_dim)
+        else:
+            v = F.linear(x, w_v, b_v).view(*x.shape[:-1], num_groups, head_dim).transpose(-2, -3)
+            out = torch.matmul(attn.transpose(-1, -2), v)  # [..., G, Q*H/G, head_dim]
+            out = out.view(*out.shape[:-2], num_queries, group_size, head_dim).transpose(-3, -4)
+
+        return self.out_proj(out.reshape(*out.shape[:-3], d))
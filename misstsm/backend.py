@@ -0,0 +1,27 @@
+import os
+
+
+BACKENDS = ('optimized', 'reference')
+
+# process-wide, read by every MissTSM layer and attention call
+_backend = os.environ.get('MISSTSM_BACKEND', 'optimized')
+
+
+def set_backend(name):
+    """
+    Select the execution backend of every MissTSM layer: 'optimized' (default) or 'reference',
+    the original straightforward implementation
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("unknown MissTSM backend {}, options: {}".format(name, BACKENDS))
+    _backend = name
+
+
+def get_backend():
+    """
+    The process-wide backend to run with
+    """
+    if _backend not in BACKENDS:
+        raise ValueError("unknown MissTSM backend {}, options: {}".format(_backend, BACKENDS))
+    return _backend
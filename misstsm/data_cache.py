@@ -0,0 +1,233 @@
+"""
+Persistent cache of parsed datasets: the arrays of a parsed source file are stored as .npy files and
+opened memory-mapped, so warm starts skip pandas and concurrent runs share the pages. An entry is
+keyed by a hash of the source file contents and of the preprocessing parameters.
+Files larger than memory are streamed into an entry chunk by chunk (cached_stream, stream_series).
+Series values can be stored at reduced precision (float16, or bfloat16 kept as the upper 16 bits of
+float32 in uint16 arrays) and are widened to float32 by from_storage when a batch is assembled.
+Within a process a parsed file is also kept in memory, so its splits (train, val, test and repeated
+data_provider calls) are views of one set of arrays.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from misstsm.data_source import count_rows, iter_chunks
+from misstsm.timefeatures import calendar_features, time_features
+
+CACHE_VERSION = 2
+
+# (path, size, mtime, params, cache_dir) -> (meta, arrays) parsed by this process
+_parsed = {}
+
+
+def file_fingerprint(path, chunk_size=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def cache_key(path, params):
+    params = dict(params, version=CACHE_VERSION, source=file_fingerprint(path))
+    return hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+
+def load_entry(entry):
+    meta_path = os.path.join(entry, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in meta.pop('_arrays')}
+    return meta, arrays
+
+
+def save_entry(entry, meta, arrays):
+    def write(tmp):
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+        return meta, list(arrays)
+    write_entry(entry, write)
+
+
+def write_entry(entry, write):
+    """
+    write(tmp) -> (meta, names): saves the arrays names as tmp/<name>.npy
+    """
+    # written aside and renamed into place, a concurrent writer of the same entry loses the race harmlessly
+    tmp = '{}.tmp{}'.format(entry, os.getpid())
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        meta, names = write(tmp)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, _arrays=list(names)), f)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def cached(cache_dir, path, params, parse):
+    """
+    parse() -> (meta, arrays): a json serializable dict and a dict of numpy arrays
+    returns the (meta, arrays) of parse(), memory-mapped from cache_dir unless it is empty, and shared
+    by every call with the same file and parameters in this process (the arrays are read-only)
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, json.dumps(params, sort_keys=True), cache_dir)
+    if key in _parsed:
+        return _parsed[key]
+
+    if cache_dir:
+        entry = os.path.join(cache_dir, cache_key(path, params))
+        hit = load_entry(entry)
+        if hit is None:
+            os.makedirs(cache_dir, exist_ok=True)
+            save_entry(entry, *parse())
+            hit = load_entry(entry)
+    else:
+        hit = parse()
+        for array in hit[1].values():
+            array.setflags(write=False)
+
+    _parsed[key] = hit
+    return hit
+
+
+def cached_stream(cache_dir, path, params, write):
+    """
+    cached() for files larger than memory: write(tmp) -> (meta, names) writes the arrays to the new
+    entry itself (see write_entry), e.g. chunk by chunk into np.lib.format.open_memmap arrays
+    """
+    if not cache_dir:
+        raise ValueError('streaming {} requires a dataset cache directory'.format(path))
+    params = dict(params, stream=True)
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns, json.dumps(params, sort_keys=True), cache_dir)
+    if key in _parsed:
+        return _parsed[key]
+
+    entry = os.path.join(cache_dir, cache_key(path, params))
+    hit = load_entry(entry)
+    if hit is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        write_entry(entry, write)
+        hit = load_entry(entry)
+
+    _parsed[key] = hit
+    return hit
+
+
+def stream_series(entry, path, data_cols, borders, scale, timeenc, freq, storage, calendar_names, chunk_rows):
+    """
+    parses the date and data_cols columns of a file larger than memory into the data, mask and stamp
+    .npy arrays of a dataset cache entry, chunk_rows rows at a time. borders(num_rows) -> (border1s,
+    border2s); the scaler is fitted on the train rows in a first pass (nan-aware partial_fit), and
+    the values are stored as the storage dtype
+    """
+    num_rows = count_rows(path)
+    border1s, border2s = borders(num_rows)
+
+    scaler = StandardScaler()
+    if scale:
+        seen = 0
+        for chunk in iter_chunks(path, data_cols, chunk_rows):
+            values = chunk.values[:border2s[0] - seen]
+            scaler.partial_fit(values)
+            seen += len(values)
+            if seen == border2s[0]:
+                break
+
+    arrays = {}
+    start = 0
+    for chunk in iter_chunks(path, ['date'] + data_cols, chunk_rows):
+        values = chunk[data_cols].values
+        if scale:
+            values = scaler.transform(values)
+        dates = pd.to_datetime(chunk['date'])
+        if timeenc == 0:
+            data_stamp = calendar_features(dates, calendar_names)
+        elif timeenc == 1:
+            data_stamp = time_features(pd.to_datetime(dates.values), freq=freq).transpose(1, 0)
+
+        parsed = dict(stored_series(values, storage), stamp=data_stamp)
+        if not arrays:
+            # allocated with the first chunk, which gives the number of time features
+            arrays = {name: np.lib.format.open_memmap(
+                os.path.join(entry, name + '.npy'), mode='w+', shape=(num_rows,) + array.shape[1:],
+                dtype=array.dtype if name != 'stamp' else np.float32) for name, array in parsed.items()}
+        for name, array in parsed.items():
+            arrays[name][start:start + len(array)] = array
+        start += len(chunk)
+
+    for array in arrays.values():
+        array.flush()
+    meta = {'border1s': border1s, 'border2s': border2s,
+            'scaler': scaler_stats(scaler) if scale else None}
+    return meta, list(arrays)
+
+
+def storage_dtype(name):
+    """
+    numpy dtype of the arrays stored as 'float32', 'float16' or 'bfloat16' (uint16 bit patterns)
+    """
+    return {'float32': np.float32, 'float16': np.float16, 'bfloat16': np.uint16}[name]
+
+
+def to_storage(values, name):
+    """
+    float values -> array of storage_dtype(name), bfloat16 rounded to nearest even
+    """
+    if name != 'bfloat16':
+        return values.astype(storage_dtype(name))
+    bits = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    bits = bits + (np.uint32(0x7FFF) + ((bits >> 16) & np.uint32(1)))
+    return (bits >> 16).astype(np.uint16)
+
+
+def stored_series(values, name):
+    """
+    'data' (the values zero-filled, as storage_dtype(name)) and 'mask' (observed values) arrays of a
+    series with nan for missing values
+    """
+    return {'data': to_storage(np.nan_to_num(values), name), 'mask': ~np.isnan(values)}
+
+
+def from_storage(array):
+    """
+    float32 values of a stored array, without a copy for float32 storage
+    """
+    if array.dtype == np.uint16:
+        return (array.astype(np.uint32) << 16).view(np.float32)
+    return array.astype(np.float32, copy=False)
+
+
+def scaler_stats(scaler):
+    return {'mean': scaler.mean_.tolist(), 'var': scaler.var_.tolist(), 'scale': scaler.scale_.tolist(),
+            # per feature counts when the data has missing values
+            'n_samples_seen': np.asarray(scaler.n_samples_seen_).tolist()}
+
+
+def load_scaler(stats):
+    """
+    StandardScaler from scaler_stats, unfitted for None
+    """
+    scaler = StandardScaler()
+    if stats is not None:
+        scaler.mean_ = np.array(stats['mean'])
+        scaler.var_ = np.array(stats['var'])
+        scaler.scale_ = np.array(stats['scale'])
+        n_samples_seen = stats['n_samples_seen']
+        scaler.n_samples_seen_ = np.array(n_samples_seen) if isinstance(n_samples_seen, list) else n_samples_seen
+        scaler.n_features_in_ = len(scaler.mean_)
+    return scaler
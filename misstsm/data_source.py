@@ -0,0 +1,122 @@
+"""
+Readers of the dataset files: csv, or the columnar Parquet and Feather (Arrow IPC) formats, chosen by
+the file suffix. Only the requested columns are read, for a columnar file without touching the others.
+Large files can be read in chunks of rows (iter_chunks), one at a time in memory.
+Convert the existing csv files once with: python -m misstsm.data_source data.csv [...] --format parquet
+"""
+import argparse
+import os
+
+import pandas as pd
+
+FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather'}
+
+
+def source_format(path):
+    suffix = os.path.splitext(path)[1].lower()
+    if suffix not in FORMATS:
+        raise ValueError('unsupported data file {}, expected one of {}'.format(path, ', '.join(FORMATS)))
+    return FORMATS[suffix]
+
+
+def read_columns(path):
+    """
+    column names of the file, from its header or schema
+    """
+    fmt = source_format(path)
+    if fmt == 'csv':
+        return list(pd.read_csv(path, nrows=0).columns)
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fmt == 'parquet':
+        return list(pq.read_schema(path).names)
+    with pa.memory_map(path) as source:
+        return list(pa.ipc.open_file(source).schema.names)
+
+
+def read_table(path, columns=None):
+    """
+    DataFrame of the given columns of the file (every column for None), in the given order
+    """
+    fmt = source_format(path)
+    if fmt == 'csv':
+        df = pd.read_csv(path, usecols=columns)
+    elif fmt == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_feather(path, columns=columns)
+    return df if columns is None else df[list(columns)]
+
+
+def count_rows(path):
+    """
+    number of data rows of the file, without parsing it
+    """
+    fmt = source_format(path)
+    if fmt == 'csv':
+        lines, last = 0, b'\n'
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                lines += block.count(b'\n')
+                last = block[-1:]
+        # the header line, and a last line without a line break
+        return lines - 1 + (last != b'\n')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fmt == 'parquet':
+        return pq.ParquetFile(path).metadata.num_rows
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(i).num_rows for i in range(reader.num_record_batches))
+
+
+def iter_chunks(path, columns=None, chunk_rows=100000):
+    """
+    DataFrames of at most chunk_rows consecutive rows of the given columns, in file order
+    """
+    fmt = source_format(path)
+    if fmt == 'csv':
+        for df in pd.read_csv(path, usecols=columns, chunksize=chunk_rows):
+            yield df if columns is None else df[list(columns)]
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            # record batches are decompressed one at a time
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select(list(columns))
+            for start in range(0, batch.num_rows, chunk_rows):
+                yield batch.slice(start, chunk_rows).to_pandas()
+
+
+def convert(path, fmt='parquet', date_col='date'):
+    """
+    writes the csv file next to it in the columnar format, with the date column parsed
+    """
+    df = pd.read_csv(path)
+    if date_col in df.columns:
+        df[date_col] = pd.to_datetime(df[date_col])
+    out = os.path.splitext(path)[0] + '.' + fmt
+    if fmt == 'parquet':
+        df.to_parquet(out, index=False)
+    else:
+        df.to_feather(out)
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert csv datasets to a columnar format')
+    parser.add_argument('paths', nargs='+', help='csv files to convert')
+    parser.add_argument('--format', type=str, default='parquet', choices=['parquet', 'feather'], help='output format')
+    parser.add_argument('--date_col', type=str, default='date', help='date column, stored as timestamps')
+    args = parser.parse_args()
+
+    for path in args.paths:
+        print('{} -> {}'.format(path, convert(path, args.format, args.date_col)))
@@ -0,0 +1,152 @@
+import torch
+import torch.nn as nn
+from positional_encodings.torch_encodings import PositionalEncoding2D
+
+from misstsm import reference
+from misstsm.backend import get_backend
+
+
+_pos_embed_2d_cache = {}
+
+
+def get_2d_pos_embed(seq_len, num_feats, embed_dim, device='cpu', dtype=torch.float32):
+    """
+    (1, seq_len, num_feats, embed_dim) PositionalEncoding2D table, built once per shape, device and dtype
+    """
+    key = (seq_len, num_feats, embed_dim, torch.device(device), dtype)
+    if key not in _pos_embed_2d_cache:
+        with torch.no_grad():
+            z = torch.zeros((1, seq_len, num_feats, embed_dim), device=device, dtype=dtype)
+            _pos_embed_2d_cache[key] = PositionalEncoding2D(embed_dim).to(device)(z)
+    return _pos_embed_2d_cache[key]
+
+
+class CachedPositionalEncoding2D(PositionalEncoding2D):
+    """
+    PositionalEncoding2D whose (1, seq_len, num_feats, d_model) table is built once per shape
+    and shared by every MissTSM layer in the process; it broadcasts over the batch
+    """
+    def forward(self, tensor):
+        _, seq_len, num_feats, d_model = tensor.shape
+        return self.table(seq_len, num_feats, d_model, tensor.device, tensor.dtype)
+
+    def table(self, seq_len, num_feats, d_model, device, dtype):
+        return get_2d_pos_embed(seq_len, num_feats, d_model, device, dtype)
+
+
+class TFI(nn.Module):
+    """
+    Embed each feature with its own Linear(1, d) + LayerNorm(d), computed for all features at once
+    """
+    def __init__(self, input_dim=8, embedding_dim=8, norm_layer=None, eps=1e-5):
+        super().__init__()
+        self.input_dim = input_dim
+        self.embedding_dim = embedding_dim
+        self.eps = eps
+        self.weight = nn.Parameter(torch.empty(input_dim, embedding_dim))
+        self.bias = nn.Parameter(torch.empty(input_dim, embedding_dim))
+        self.norm_weight = nn.Parameter(torch.empty(input_dim, embedding_dim))
+        self.norm_bias = nn.Parameter(torch.empty(input_dim, embedding_dim))
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # same distributions as the default nn.Linear(1, d) and nn.LayerNorm(d) init
+        nn.init.uniform_(self.weight, -1, 1)
+        nn.init.uniform_(self.bias, -1, 1)
+        nn.init.ones_(self.norm_weight)
+        nn.init.zeros_(self.norm_bias)
+
+    def forward(self, x):
+        if get_backend() == 'reference':
+            return reference.embed_features(self, x)
+        return self._embed(x)
+
+    def embed_observed(self, values, feat_idx):
+        """
+        Embed a flat vector of cells, value i belonging to feature feat_idx[i]
+        """
+        return self._embed(values, feat_idx)
+
+    def _embed(self, x, feat_idx=None):
+        # LayerNorm(w*x + b) = (a*x + c) / sqrt(var(x) + eps) with a, c the centred w, b
+        # and var(x) = x^2 * mean(a*a) + 2x * mean(a*c) + mean(c*c)
+        a = self.weight - self.weight.mean(dim=-1, keepdim=True)
+        c = self.bias - self.bias.mean(dim=-1, keepdim=True)
+        aa, ac, cc = (a * a).mean(dim=-1), (a * c).mean(dim=-1), (c * c).mean(dim=-1)
+        scale, shift, norm_bias = a * self.norm_weight, c * self.norm_weight, self.norm_bias
+        if feat_idx is not None:
+            aa, ac, cc = aa[feat_idx], ac[feat_idx], cc[feat_idx]
+            scale, shift, norm_bias = scale[feat_idx], shift[feat_idx], norm_bias[feat_idx]
+
+        var = x * x * aa + 2 * x * ac + cc
+        rstd = torch.rsqrt(var.clamp(min=0) + self.eps).unsqueeze(-1)
+
+        embedded_features = torch.addcmul(shift, x.unsqueeze(-1), scale)
+        embedded_features = torch.addcmul(norm_bias, embedded_features, rstd)
+        return embedded_features
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # checkpoints saved with one nn.Sequential(Linear, LayerNorm) per feature
+        if prefix + 'embeddings.0.0.weight' in state_dict:
+            for name, key in [('weight', '0.weight'), ('bias', '0.bias'), ('norm_weight', '1.weight'), ('norm_bias', '1.bias')]:
+                state_dict[prefix + name] = torch.stack([
+                    state_dict.pop(prefix + 'embeddings.{}.{}'.format(i, key)).reshape(-1)
+                    for i in range(self.input_dim)
+                ])
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def __setstate__(self, state):
+        # whole models pickled with one nn.Sequential(Linear, LayerNorm) per feature
+        super().__setstate__(state)
+        if 'embeddings' in self._modules:
+            embeddings = self._modules.pop('embeddings')
+            self.input_dim = len(embeddings)
+            self.embedding_dim = embeddings[0][0].out_features
+            self.eps = embeddings[0][1].eps
+            with torch.no_grad():
+                self.weight = nn.Parameter(torch.stack([emb[0].weight.reshape(-1) for emb in embeddings]))
+                self.bias = nn.Parameter(torch.stack([emb[0].bias for emb in embeddings]))
+                self.norm_weight = nn.Parameter(torch.stack([emb[1].weight for emb in embeddings]))
+                self.norm_bias = nn.Parameter(torch.stack([emb[1].bias for emb in embeddings]))
+
+class LinearEmbed(nn.Module):
+    """
+    Embed each feature
+    """
+    def __init__(self, embedding_dim=8):
+        super().__init__()
+        self.embedding = nn.Sequential(nn.Linear(1, embedding_dim), nn.LayerNorm(embedding_dim))
+        
+
+    def forward(self, x):
+        embedded_features = self.embedding(x.unsqueeze(-1))
+        return embedded_features
+
+    def embed_observed(self, values, feat_idx):
+        return self.embedding(values.unsqueeze(-1))
+
+
+def embed_observed(x, m, fill, mask_embed, pos_embed, cells=None):
+    """
+    Keys of the cells of x [B, L, N] (those set in the bool cells, every cell for None) with their 2D
+    positional encoding, embedding only the observed values (m > 0). A missing cell holds the value
+    of a zero fill after RevIN, fill [B, 1, N], and shares its embedding per sample and feature
+    returns: the packed embeddings [K, d] and their flat indices into x [K], observed cells first
+    """
+    batch_size, window_size, num_feat = x.shape
+    observed = m > 0
+    if cells is None:
+        cells = torch.ones_like(observed)
+    observed_idx = (cells & observed).reshape(-1).nonzero(as_tuple=True)[0]
+    missing_idx = (cells & ~observed).reshape(-1).nonzero(as_tuple=True)[0]
+    idx = torch.cat([observed_idx, missing_idx])
+    feat = idx % num_feat
+    step = (idx // num_feat) % window_size
+
+    emb = mask_embed.embed_observed(x.reshape(-1)[observed_idx], feat[:len(observed_idx)])
+    emb_fill = mask_embed(fill)[:, 0]
+    emb = torch.cat([emb, emb_fill[missing_idx // (window_size * num_feat), feat[len(observed_idx):]]])
+    table = pos_embed.table(window_size, num_feat, emb.shape[-1], emb.device, emb.dtype)
+    emb = emb + table[0, step, feat]
+
+    return emb, idx
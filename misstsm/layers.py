@@ -0,0 +1,586 @@
+import torch
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+from misstsm import reference
+from misstsm.attention import GroupedQueryAttention, segment_single_query_attention, single_query_attention
+from misstsm.backend import get_backend
+from misstsm.embed import CachedPositionalEncoding2D, LinearEmbed, TFI, embed_observed
+
+
+def chunked(fn, tensors, chunk_size, use_checkpoint, dim=1):
+    """
+    Apply fn to consecutive slices of chunk_size along dim of every tensor and concatenate the outputs.
+    With use_checkpoint the activations of each slice are recomputed in backward instead of stored.
+    """
+    size = tensors[0].shape[dim]
+    chunk_size = chunk_size or size
+    outputs = []
+    for start in range(0, size, chunk_size) if size else [0]:
+        args = [t.narrow(dim, start, min(chunk_size, size - start)) for t in tensors]
+        if use_checkpoint and torch.is_grad_enabled():
+            outputs.append(checkpoint(fn, *args, use_reentrant=False))
+        else:
+            outputs.append(fn(*args))
+    return torch.cat(outputs, dim=dim)
+
+
+def apply_blocks(blocks, x, grad_checkpoint=False):
+    """
+    Apply the transformer blocks in sequence. With grad_checkpoint the activations inside each block
+    are recomputed in backward instead of stored, the gradients are unchanged.
+    """
+    for blk in blocks:
+        if grad_checkpoint and torch.is_grad_enabled():
+            x = checkpoint(blk, x, use_reentrant=False)
+        else:
+            x = blk(x)
+    return x
+
+
+class _MissTSMBase(nn.Module):
+    """
+    Parameters and shared steps of the MissTSM layers
+    layernorm_first: normalise the embedded cells before the cross-attention (PatchTST) instead of
+    the attention output (iTransformer)
+    """
+    # how the cells are grouped into attention rows, see reference.forward
+    layout = None
+
+    def __init__(self, q_dim=8,
+                 k_dim=8,
+                 v_dim=8,
+                 num_feats=8,
+                 num_heads=1,
+                 out_dim=None,
+                 norm=False,
+                 embed="linear",
+                 mtsm_norm=False,
+                 layernorm=True,
+                 observed_only=False,
+                 chunk_size=None,
+                 use_checkpoint=False,
+                 num_queries=1,
+                 kv_groups=None,
+                 layernorm_first=False):
+        super().__init__()
+
+        # TODO: Query dimension should be greater than key, value dimension
+        self.q_dim = q_dim
+        self.k_dim = k_dim
+        self.v_dim = v_dim
+        self.num_heads = num_heads
+        self.var_query = nn.Parameter(torch.zeros(1, num_queries, self.q_dim), requires_grad=True)
+        self.num_feats = num_feats
+        self.norm = norm
+        self.mtsm_norm = mtsm_norm
+        self.embed = embed
+        self.observed_only = observed_only
+        self.chunk_size = chunk_size
+        self.use_checkpoint = use_checkpoint
+        self.num_queries = num_queries
+        self.kv_groups = kv_groups
+        self.layernorm_first = layernorm_first
+        # several queries or shared key/value groups need the grouped attention instead of mhca
+        self.grouped = num_queries > 1 or kv_groups is not None
+        if self.grouped and observed_only:
+            raise ValueError("observed_only supports a single query with nn.MultiheadAttention only")
+        self.out_dim = out_dim
+
+        ## Do we really need Multi-head attention?
+        ## Grouped query-attention similar to llama3
+
+        if self.grouped:
+            self.mhca = GroupedQueryAttention(self.q_dim, num_heads=self.num_heads, num_kv_groups=kv_groups or 1)
+        else:
+            self.mhca = nn.MultiheadAttention(embed_dim=self.q_dim, num_heads=self.num_heads, batch_first=True)
+
+        if self.embed=="linear":
+            self.mask_embed = LinearEmbed(embedding_dim=self.q_dim)
+        else:
+            self.mask_embed = TFI(input_dim=self.num_feats, embedding_dim=self.q_dim)
+
+        self.pos_embed = CachedPositionalEncoding2D(self.q_dim)
+
+        if layernorm:
+            self.layernorm = nn.LayerNorm(self.q_dim)
+        else:
+            self.layernorm = None
+
+    def build_projection(self, out_dim):
+        self.out_dim = out_dim
+        if self.grouped:
+            # one summary per query, concatenated before the projection
+            self.projection = nn.Sequential(nn.Flatten(-2), nn.Linear(self.num_queries * self.q_dim, self.out_dim))
+        else:
+            self.projection = nn.Linear(self.q_dim, self.out_dim)
+
+    def RevIN(self, x, m):
+        '''
+        Perform Reversible instance normalization
+        '''
+        means = torch.sum(x, dim=1) / torch.sum(m == 1, dim=1)
+        means = means.unsqueeze(1)
+        x = x - means
+
+        stdev = torch.sqrt(torch.sum(x * x, dim=1) / torch.sum(m == 1, dim=1) + 1e-5)
+        stdev = stdev.unsqueeze(1)
+        x = x / stdev
+
+        return x, means, stdev
+
+    def missing_fill(self, x, means, std):
+        '''
+        Value of the missing cells after RevIN, the loaders zero-fill them: [B, 1, N]
+        '''
+        if means is None:
+            return x.new_zeros(x.shape[0], 1, x.shape[-1])
+        return -means / std
+
+    def denorm(self, x, means, std):
+        if self.mtsm_norm:
+            x = x * (std[:, 0, :].unsqueeze(1).repeat(1, x.shape[1], 1))
+            x = x + (means[:, 0, :].unsqueeze(1).repeat(1, x.shape[1], 1))
+        return x
+
+    def norm_keys(self, x):
+        # layernorm of the embedded cells, PatchTST ordering
+        if self.layernorm and self.layernorm_first:
+            x = self.layernorm(x)
+        return x
+
+    def norm_summary(self, x):
+        # layernorm of the attention output, iTransformer ordering
+        if self.layernorm and not self.layernorm_first:
+            x = self.layernorm(x)
+        return x
+
+    def cross_attention(self, x, m):
+
+        if self.grouped:
+            attn_out = self.mhca(self.var_query, x, key_padding_mask=m)
+        else:
+            attn_out = single_query_attention(self.var_query, x, self.mhca, key_padding_mask=m)
+
+        return attn_out
+
+    def forward(self, x, m):
+        if get_backend() == 'reference':
+            return reference.forward(self, x, m)
+        return self.optimized_forward(x, m)
+
+
+class iMissTSM(_MissTSMBase):
+
+    """
+    MissTSM attending over segments of seq_len cells of the (B, N, L) reshaped window,
+    projected to every timestep
+    """
+    layout = 'inverted'
+
+    def __init__(self, q_dim=8,
+                 k_dim=8,
+                 v_dim=8,
+                 num_feats=8,
+                 num_heads=1,
+                 out_dim=None,
+                 norm=False,
+                 embed="linear",
+                 mtsm_norm=False,
+                 layernorm=True,
+                 seq_len=336,
+                 observed_only=False,
+                 chunk_size=None,
+                 use_checkpoint=False,
+                 num_queries=1,
+                 kv_groups=None,
+                 layernorm_first=False):
+        super().__init__(q_dim=q_dim, k_dim=k_dim, v_dim=v_dim, num_feats=num_feats, num_heads=num_heads,
+                         norm=norm, embed=embed, mtsm_norm=mtsm_norm, layernorm=layernorm,
+                         observed_only=observed_only, chunk_size=chunk_size, use_checkpoint=use_checkpoint,
+                         num_queries=num_queries, kv_groups=kv_groups, layernorm_first=layernorm_first)
+        self.seq_len = seq_len
+        self.build_projection(out_dim or seq_len)
+
+    def cross_attention(self, x, m):
+
+        batch_size, window_size, num_feat, d = x.shape
+
+        x = x.reshape(batch_size, num_feat, window_size, d)
+        m = m.reshape(batch_size, num_feat, window_size)
+
+        return super().cross_attention(x, m)
+
+    def chunked_cross_attention(self, x, m):
+        '''
+        Embed and cross-attend a bounded number of segments at a time (about chunk_size timesteps
+        worth of cells), recomputed in backward with use_checkpoint. Same result as cross_attention
+        '''
+        batch_size, window_size, num_feat = x.shape
+
+        # segment j holds cells j*L .. (j+1)*L - 1 of the flattened (L, N) grid, see cross_attention
+        x = x.reshape(batch_size, num_feat, window_size)
+        m = m.reshape(batch_size, num_feat, window_size)
+        feat = torch.arange(window_size * num_feat, device=x.device).remainder(num_feat)
+        feat = feat.view(1, num_feat, window_size)
+        pos_embed = self.pos_embed.table(window_size, num_feat, self.q_dim, x.device, x.dtype)
+        pos_embed = pos_embed.reshape(1, num_feat, window_size, self.q_dim)
+
+        def attend(x, m, feat, pos_embed):
+            x = self.norm_keys(self.mask_embed.embed_observed(x, feat) + pos_embed)
+            return super(iMissTSM, self).cross_attention(x, m)
+
+        chunk_size = max(1, self.chunk_size * num_feat // window_size) if self.chunk_size else None
+        return chunked(attend, (x, m, feat, pos_embed), chunk_size, self.use_checkpoint)
+
+    def observed_cross_attention(self, x, m, fill):
+        '''
+        Embed the observed cells one by one and the missing ones once per sample and feature, see
+        embed_observed. Same attention as cross_attention, the segments follow its (B, N, L) chunking
+        '''
+        batch_size, window_size, num_feat = x.shape
+
+        x, idx = embed_observed(x, m, fill, self.mask_embed, self.pos_embed)
+        x = self.norm_keys(x)
+        attn_out = segment_single_query_attention(self.var_query, x, idx // window_size, batch_size * num_feat,
+                                                  self.mhca, bias=m.reshape(-1)[idx])
+
+        return attn_out.reshape(batch_size, num_feat, -1)
+
+    def optimized_forward(self, x, m):
+
+        # perform rev instance norm
+        if self.mtsm_norm:
+            x, means, std = self.RevIN(x, m)
+        else:
+            means, std = None, None
+
+        x_inp = x
+
+        if self.observed_only:
+            # embed the observed cells only, the missing ones share an embedding
+            x = self.observed_cross_attention(x, m, self.missing_fill(x, means, std))
+        elif self.chunk_size or self.use_checkpoint:
+            # embed and cross-attend in bounded chunks
+            x = self.chunked_cross_attention(x, m)
+        else:
+            # embed patches
+            x = self.mask_embed(x)
+
+            # add pos embed w/o cls token
+            x = self.norm_keys(x + self.pos_embed(x))
+
+            # perform cross-attention
+            x = self.cross_attention(x, m)
+
+        x = self.norm_summary(x)
+
+        # linear projection
+        x = self.projection(x)
+        x = x.permute(0, 2, 1)
+
+        x = m*x_inp + (1-m)*x
+
+        return self.denorm(x, means, std)
+
+
+class MissTSMSkip(_MissTSMBase):
+
+    """
+    MissTSM with skip connections
+    """
+    layout = 'skip'
+
+    def __init__(self, q_dim=8,
+                 k_dim=8,
+                 v_dim=8,
+                 num_feats=8,
+                 num_heads=1,
+                 out_dim=None,
+                 norm=False,
+                 embed="linear",
+                 mtsm_norm=False,
+                 layernorm=True,
+                 observed_only=False,
+                 chunk_size=None,
+                 use_checkpoint=False,
+                 num_queries=1,
+                 kv_groups=None,
+                 layernorm_first=False):
+        super().__init__(q_dim=q_dim, k_dim=k_dim, v_dim=v_dim, num_feats=num_feats, num_heads=num_heads,
+                         norm=norm, embed=embed, mtsm_norm=mtsm_norm, layernorm=layernorm,
+                         observed_only=observed_only, chunk_size=chunk_size, use_checkpoint=use_checkpoint,
+                         num_queries=num_queries, kv_groups=kv_groups, layernorm_first=layernorm_first)
+        self.build_projection(out_dim or num_feats)
+
+    def chunked_cross_attention(self, x, m, steps, batch_size, window_size):
+        '''
+        Embed and cross-attend the gathered rows [R, N] a bounded number at a time (chunk_size
+        timesteps of the batch), recomputed in backward with use_checkpoint
+        steps: the timestep of every row
+        '''
+        num_feat = x.shape[-1]
+        pos_embed = self.pos_embed.table(window_size, num_feat, self.q_dim, x.device, x.dtype)
+
+        def attend(x, m, steps):
+            x = self.norm_keys(self.mask_embed(x) + pos_embed[0, steps])
+            return self.cross_attention(x, m)
+
+        chunk_size = self.chunk_size * batch_size if self.chunk_size else None
+        return chunked(attend, (x, m, steps), chunk_size, self.use_checkpoint, dim=0)
+
+    def observed_cross_attention(self, x, m, fill, incomplete, rows):
+        '''
+        Embed the observed cells one by one and the missing ones once per sample and feature, see
+        embed_observed. Same attention as cross_attention over the rows
+        incomplete: [B, L] bool of the timesteps to compute, rows: their flat (sample, timestep) indices
+        returns: [len(rows), d]
+        '''
+        batch_size, window_size, num_feat = x.shape
+
+        cells = incomplete.unsqueeze(-1).expand_as(m)
+        x, idx = embed_observed(x, m, fill, self.mask_embed, self.pos_embed, cells=cells)
+        x = self.norm_keys(x)
+        position = torch.zeros(batch_size * window_size, dtype=torch.long, device=x.device)
+        position[rows] = torch.arange(len(rows), device=x.device)
+        attn_out = segment_single_query_attention(self.var_query, x, position[idx // num_feat], len(rows),
+                                                  self.mhca, bias=m.reshape(-1)[idx])
+
+        return attn_out
+
+    def optimized_forward(self, x, m):
+
+        # perform rev instance norm
+        if self.mtsm_norm:
+            x, means, std = self.RevIN(x, m)
+        else:
+            means, std = None, None
+
+        x_inp = x
+        batch_size, window_size, num_feat = x.shape
+
+        # the skip connection keeps every observed value, so only the timesteps
+        # with at least one missing feature need to be imputed
+        incomplete = (m == 0).any(dim=-1)
+        rows = incomplete.reshape(-1).nonzero(as_tuple=True)[0]
+        x_rows = x.reshape(-1, num_feat)[rows]
+        m_rows = m.reshape(-1, num_feat)[rows]
+
+        if self.observed_only:
+            # embed the observed cells only, the missing ones share an embedding
+            x = self.observed_cross_attention(x, m, self.missing_fill(x, means, std), incomplete, rows)
+        elif self.chunk_size or self.use_checkpoint:
+            # embed and cross-attend in bounded chunks
+            x = self.chunked_cross_attention(x_rows, m_rows, rows % window_size, batch_size, window_size)
+        else:
+            # embed patches
+            x = self.mask_embed(x_rows)
+
+            # add pos embed w/o cls token
+            pos_embed = self.pos_embed.table(window_size, num_feat, self.q_dim, x.device, x.dtype)
+            x = self.norm_keys(x + pos_embed[0, rows % window_size])
+
+            # perform cross-attention
+            x = self.cross_attention(x, m_rows)
+
+        x = self.norm_summary(x)
+        # linear projection
+        x = self.projection(x)
+
+        x = m_rows*x_rows + (1-m_rows)*x
+        x = x_inp.reshape(-1, num_feat).index_copy(0, rows, x).reshape(x_inp.shape)
+
+        return self.denorm(x, means, std)
+
+
+class MissTSM(_MissTSMBase):
+
+    """
+    MissTSM: one learned query attends over the embedded features of every timestep
+    """
+    layout = 'timestep'
+
+    def __init__(self, q_dim=8,
+                 k_dim=8,
+                 v_dim=8,
+                 num_feats=8,
+                 num_heads=1,
+                 out_dim=None,
+                 norm=False,
+                 embed="linear",
+                 mtsm_norm=False,
+                 layernorm=True,
+                 observed_only=False,
+                 chunk_size=None,
+                 use_checkpoint=False,
+                 num_queries=1,
+                 kv_groups=None,
+                 layernorm_first=False):
+        super().__init__(q_dim=q_dim, k_dim=k_dim, v_dim=v_dim, num_feats=num_feats, num_heads=num_heads,
+                         norm=norm, embed=embed, mtsm_norm=mtsm_norm, layernorm=layernorm,
+                         observed_only=observed_only, chunk_size=chunk_size, use_checkpoint=use_checkpoint,
+                         num_queries=num_queries, kv_groups=kv_groups, layernorm_first=layernorm_first)
+        self._stream = None
+        self.build_projection(out_dim or num_feats)
+
+    def chunked_cross_attention(self, x, m, embedded=None):
+        '''
+        Embed and cross-attend chunk_size timesteps at a time, recomputed in backward with use_checkpoint
+        '''
+        batch_size, window_size, num_feat = m.shape
+        pos_embed = self.pos_embed.table(window_size, num_feat, self.q_dim, m.device, x.dtype)
+
+        def attend(x, m, pos_embed):
+            if embedded is None:
+                x = self.mask_embed(x)
+            return self.cross_attention(self.norm_keys(x + pos_embed), m)
+
+        x = x if embedded is None else embedded
+        return chunked(attend, (x, m, pos_embed), self.chunk_size, self.use_checkpoint)
+
+    def observed_cross_attention(self, x, m, fill):
+        '''
+        Embed the observed cells one by one and the missing ones once per sample and feature, see
+        embed_observed. Same attention as cross_attention
+        '''
+        batch_size, window_size, num_feat = x.shape
+
+        x, idx = embed_observed(x, m, fill, self.mask_embed, self.pos_embed)
+        x = self.norm_keys(x)
+        attn_out = segment_single_query_attention(self.var_query, x, idx // num_feat, batch_size * window_size,
+                                                  self.mhca, bias=m.reshape(-1)[idx])
+
+        return attn_out.reshape(batch_size, window_size, -1)
+
+    def optimized_forward(self, x, m):
+
+        # perform rev instance norm
+        if self.mtsm_norm:
+            x, means, std = self.RevIN(x, m)
+        else:
+            means, std = None, None
+
+        return self._impute(x, m, means, std)
+
+    def _impute(self, x, m, means, std, embedded=None):
+        '''
+        Everything after RevIN, embedded optionally holds mask_embed(x) computed beforehand
+        '''
+        if self.observed_only:
+            # embed the observed cells only, the missing ones share an embedding
+            x = self.observed_cross_attention(x, m, self.missing_fill(x, means, std))
+        elif self.chunk_size or self.use_checkpoint:
+            # embed and cross-attend in bounded chunks
+            x = self.chunked_cross_attention(x, m, embedded)
+        else:
+            # embed patches
+            x = self.mask_embed(x) if embedded is None else embedded
+
+            # add pos embed w/o cls token
+            x = self.norm_keys(x + self.pos_embed(x))
+
+            # perform cross-attention
+            x = self.cross_attention(x, m)
+
+        x = self.norm_summary(x)
+        # linear projection
+        x = self.projection(x)
+
+        return self.denorm(x, means, std)
+
+    def reset_stream(self, window_size):
+        '''
+        Start a new sliding-window inference run over windows of window_size timesteps (see stream)
+        '''
+        self._stream = {'window_size': window_size, 'steps': 0}
+
+    def stream_exact(self):
+        '''
+        Whether stream can keep the attention output of every timestep. The timestep part of the 2D
+        positional encoding is the same for every key of a row, so it cancels in the softmax and only
+        adds its value projection to the output. RevIN over the window or a layernorm of the keys
+        change the output of every timestep as the window slides
+        '''
+        return not self.mtsm_norm and not (self.layernorm and self.layernorm_first)
+
+    @torch.no_grad()
+    def stream(self, x_t, m_t):
+        '''
+        Sliding-window inference, x_t, m_t: [B, N] the newly arrived timestep
+        Returns forward() of the last window_size timesteps, None until that many have arrived.
+        With stream_exact only the new timestep is embedded and attended, the kept attention outputs
+        are shifted by the positional term of their slot in the window. Otherwise the cross-attention
+        runs over the whole window, with running RevIN statistics and, without mtsm_norm, the value
+        embeddings of past timesteps reused
+        '''
+        state = self._stream
+        window_size = state['window_size']
+        batch_size, num_feat = x_t.shape
+        exact = self.stream_exact()
+
+        if state['steps'] == 0:
+            # ring buffers over the window, slot steps % window_size holds the newest timestep
+            state['x'] = x_t.new_zeros(batch_size, window_size, num_feat)
+            state['m'] = m_t.new_zeros(batch_size, window_size, num_feat)
+            if exact:
+                pos_embed = self.pos_embed.table(window_size, num_feat, self.q_dim, x_t.device, x_t.dtype)
+                state['pos_embed'] = pos_embed[0, 0]
+                # a single key gets all the attention, so this is the value projection of every slot's shift
+                shift = (pos_embed[0, :, 0] - pos_embed[0, 0, 0]).unsqueeze(-2)
+                ones = shift.new_ones(window_size, 1)
+                state['shift'] = self.cross_attention(shift, ones) - self.cross_attention(shift[:1] * 0, ones[:1])
+                state['rows'] = None
+            elif self.mtsm_norm:
+                # float64 so that adding and removing timesteps does not drift over long runs
+                state['sum'] = x_t.new_zeros(batch_size, num_feat, dtype=torch.float64)
+                state['sum_sq'] = torch.zeros_like(state['sum'])
+                state['count'] = torch.zeros_like(state['sum'])
+            elif not self.observed_only:
+                state['embedded'] = x_t.new_zeros(batch_size, window_size, num_feat, self.q_dim)
+
+        slot = state['steps'] % window_size
+        if self.mtsm_norm and not exact:
+            if state['steps'] >= window_size:
+                x_old, m_old = state['x'][:, slot].double(), state['m'][:, slot]
+                state['sum'] -= x_old
+                state['sum_sq'] -= x_old * x_old
+                state['count'] -= (m_old == 1).double()
+            x_new = x_t.double()
+            state['sum'] += x_new
+            state['sum_sq'] += x_new * x_new
+            state['count'] += (m_t == 1).double()
+        state['x'][:, slot] = x_t
+        state['m'][:, slot] = m_t
+        if exact:
+            row = self.cross_attention(self.mask_embed(x_t) + state['pos_embed'], m_t)
+            if state['rows'] is None:
+                state['rows'] = row.new_zeros(batch_size, window_size, *row.shape[1:])
+            state['rows'][:, slot] = row
+        elif 'embedded' in state:
+            state['embedded'][:, slot] = self.mask_embed(x_t)
+        state['steps'] += 1
+
+        if state['steps'] < window_size:
+            return None
+
+        order = torch.arange(state['steps'], state['steps'] + window_size, device=x_t.device) % window_size
+        x, m = state['x'][:, order], state['m'][:, order]
+        if get_backend() == 'reference':
+            return reference.forward(self, x, m)
+
+        if exact:
+            x = self.norm_summary(state['rows'][:, order] + state['shift'])
+            return self.projection(x)
+
+        if self.mtsm_norm:
+            # same statistics as RevIN: sum over the window of (x - mean)^2, divided by the observed count
+            means = state['sum'] / state['count']
+            var = (state['sum_sq'] - 2 * means * state['sum'] + window_size * means * means) / state['count']
+            std = torch.sqrt(var + 1e-5).to(x.dtype).unsqueeze(1)
+            means = means.to(x.dtype).unsqueeze(1)
+            x = (x - means) / std
+        else:
+            means, std = None, None
+
+        embedded = state['embedded'][:, order] if 'embedded' in state else None
+        return self._impute(x, m, means, std, embedded=embedded)
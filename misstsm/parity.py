@@ -0,0 +1,319 @@
+"""
+Parity checks of the optimized MissTSM backend against the reference one: outputs and parameter
+gradients of every layer configuration, and the embedding / attention primitives. Also checks the
+data path against its straightforward equivalent: the dataset cache and its invalidation, the
+streamed scaler, reduced-precision storage, bool masks and the MAE window views and batches.
+Run from the repository root: python -m misstsm.parity [--tol 1e-8]
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import torch
+from sklearn.preprocessing import StandardScaler
+from torch.utils.data import DataLoader
+
+from misstsm import data_cache, reference
+from misstsm.backend import get_backend, set_backend
+from misstsm.attention import single_query_attention
+from misstsm.embed import TFI
+from misstsm.layers import MissTSM, MissTSMSkip, iMissTSM
+from misstsm.timefeatures import time_features
+from misstsm.windows import WindowBatches, rewindow, window_view, windows_to
+
+
+def make_batch(batch_size=3, window_size=12, num_feats=5, missing=0.4, seed=0):
+    gen = torch.Generator().manual_seed(seed)
+    m = (torch.rand(batch_size, window_size, num_feats, generator=gen) > missing).double()
+    # every row keeps an observed cell, the reference gives nan for rows that exclude every key
+    m[:, :, 0] = 1
+    m[0, 1:3] = 1
+    x = torch.randn(batch_size, window_size, num_feats, generator=gen, dtype=torch.float64) * m
+    return x, m
+
+
+def run(layer, x, m, backend, grad=True):
+    set_backend(backend)
+    layer.zero_grad()
+    if not grad:
+        with torch.no_grad():
+            return layer(x, m), []
+    out = layer(x, m)
+    out.pow(2).sum().backward()
+    return out.detach(), [p.grad.clone() if p.grad is not None else torch.zeros_like(p) for p in layer.parameters()]
+
+
+def max_error(a, b):
+    if not a:
+        return 0.
+    return max(float((p - q).abs().max() / max(q.abs().max(), 1)) for p, q in zip(a, b))
+
+
+def check_layer(cls, grad=True, train=True, **kwargs):
+    torch.manual_seed(0)
+    layer = cls(q_dim=8, num_feats=5, **kwargs).double().train(train)
+    # start from a random query so that the attention weights are not uniform
+    torch.nn.init.normal_(layer.var_query)
+    x, m = make_batch()
+    out, grads = run(layer, x, m, 'optimized', grad)
+    out_ref, grads_ref = run(layer, x, m, 'reference', grad)
+    return max_error([out], [out_ref]), max_error(grads, grads_ref)
+
+
+def check_observed_only(cls, grad=True, **kwargs):
+    # the packed path against the dense one on the same weights, both optimized
+    torch.manual_seed(0)
+    layer = cls(q_dim=8, num_feats=5, **kwargs).double()
+    torch.nn.init.normal_(layer.var_query)
+    x, m = make_batch()
+    layer.observed_only = True
+    out, grads = run(layer, x, m, 'optimized', grad)
+    layer.observed_only = False
+    out_dense, grads_dense = run(layer, x, m, 'optimized', grad)
+    return max_error([out], [out_dense]), max_error(grads, grads_dense)
+
+
+def check_stream(**kwargs):
+    torch.manual_seed(0)
+    layer = MissTSM(q_dim=8, num_feats=5, **kwargs).double().eval()
+    torch.nn.init.normal_(layer.var_query)
+    x, m = make_batch(window_size=20)
+    window_size = 8
+    set_backend('optimized')
+    layer.reset_stream(window_size)
+    error = 0.
+    for t in range(x.shape[1]):
+        out = layer.stream(x[:, t], m[:, t])
+        if out is not None:
+            set_backend('reference')
+            with torch.no_grad():
+                out_ref = layer(x[:, t + 1 - window_size:t + 1], m[:, t + 1 - window_size:t + 1])
+            set_backend('optimized')
+            error = max(error, max_error([out], [out_ref]))
+    return error, 0.
+
+
+def check_tfi():
+    torch.manual_seed(0)
+    embed = TFI(input_dim=5, embedding_dim=8).double()
+    x, _ = make_batch()
+    set_backend('optimized')
+    with torch.no_grad():
+        out = embed(x)
+        return max_error([out], [reference.embed_features(embed, x)]), 0.
+
+
+def check_attention(bool_mask):
+    torch.manual_seed(0)
+    mhca = torch.nn.MultiheadAttention(embed_dim=8, num_heads=2, batch_first=True).double()
+    query = torch.randn(1, 1, 8, dtype=torch.float64)
+    x, m = make_batch()
+    keys = torch.randn(*x.shape, 8, dtype=torch.float64)
+    mask = m == 0 if bool_mask else m
+    set_backend('optimized')
+    with torch.no_grad():
+        out = single_query_attention(query, keys, mhca, key_padding_mask=mask)
+        return max_error([out], [reference.query_attention(query, keys, mhca, key_padding_mask=mask)]), 0.
+
+
+def write_series(path, num_rows=50, num_feats=3, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.standard_normal((num_rows, num_feats))
+    values[rng.random(values.shape) < 0.2] = np.nan
+    df = pd.DataFrame(values, columns=['c{}'.format(i) for i in range(num_feats)])
+    df.insert(0, 'date', pd.date_range('2020-01-01', periods=num_rows, freq='h').astype(str))
+    df.to_csv(path, index=False)
+    return df
+
+
+def check_cache():
+    # a cache entry is reused across processes and rebuilt when the file or the parameters change
+    calls = []
+
+    def parse(path, params):
+        calls.append(params)
+        values = pd.read_csv(path).values[:, 1:].astype(np.float64)
+        return {'rows': len(values)}, data_cache.stored_series(values, 'float32')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path, cache_dir = os.path.join(tmp, 'data.csv'), os.path.join(tmp, 'cache')
+        expected = write_series(path).values[:, 1:].astype(np.float64)
+
+        def load(params):
+            data_cache._parsed.clear()
+            return data_cache.cached(cache_dir, path, params, lambda: parse(path, params))[1]
+
+        first, again = load({'scale': True}), load({'scale': True})
+        load({'scale': False})
+        expected = write_series(path, seed=1).values[:, 1:].astype(np.float64)
+        os.utime(path, ns=(0, 0))
+        changed = load({'scale': True})
+        data_cache._parsed.clear()
+
+        error = float(len(calls) != 3 or not isinstance(again['data'], np.memmap))
+        error += np.abs(again['data'] - first['data']).max()
+        error += np.abs(changed['data'] - data_cache.stored_series(expected, 'float32')['data']).max()
+        return float(error), 0.
+
+
+def check_stream_scaler(chunk_rows):
+    # stream_series against parsing the whole file: nan-aware scaler fitted on the train rows, values,
+    # masks and time features
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.csv')
+        df = write_series(path)
+        cols = list(df.columns[1:])
+
+        def borders(num_rows):
+            return [0, 30, 40], [30, 40, num_rows]
+
+        data_cache._parsed.clear()
+        meta, arrays = data_cache.cached_stream(os.path.join(tmp, 'cache'), path, {}, lambda entry: data_cache.stream_series(
+            entry, path, cols, borders, True, 1, 'h', 'float32', None, chunk_rows))
+        data_cache._parsed.clear()
+
+        scaler = StandardScaler().fit(df[cols].values[:30])
+        stored = data_cache.stored_series(scaler.transform(df[cols].values), 'float32')
+        stamp = time_features(pd.to_datetime(df['date'].values), freq='h').transpose(1, 0).astype(np.float32)
+        streamed = data_cache.load_scaler(meta['scaler'])
+
+        error = max(np.abs(streamed.mean_ - scaler.mean_).max(), np.abs(streamed.scale_ - scaler.scale_).max(),
+                    np.abs(arrays['data'] - stored['data']).max(), np.abs(arrays['stamp'] - stamp).max())
+        error += float((arrays['mask'] != stored['mask']).any())
+        return float(error), 0.
+
+
+def check_storage(dtype):
+    # stored values widened by from_storage against torch's own rounding to the storage dtype
+    values = np.random.default_rng(0).standard_normal((200, 4)).astype(np.float32) * 100
+    values[::7, 1] = np.nan
+    stored = data_cache.stored_series(values, dtype)
+    expected = torch.from_numpy(np.nan_to_num(values)).to(getattr(torch, dtype)).float().numpy()
+    error = np.abs(data_cache.from_storage(stored['data']) - expected).max()
+    error += float(stored['mask'].dtype != np.bool_ or (stored['mask'] != ~np.isnan(values)).any())
+    return float(error), 0.
+
+
+def check_bool_mask():
+    # bool masks collated and widened on the device against the former float masks, through a layer
+    values = np.random.default_rng(0).standard_normal((40, 5))
+    values[np.random.default_rng(1).random(values.shape) < 0.3] = np.nan
+    stored = data_cache.stored_series(values, 'float32')
+    mask_float = 1 - np.isnan(values).astype(int)
+    windows = [(stored['data'][i:i + 12], stored['mask'][i:i + 12], mask_float[i:i + 12]) for i in range(20)]
+    x, mask, mask_old = next(iter(DataLoader(windows, batch_size=len(windows))))
+
+    torch.manual_seed(0)
+    layer = MissTSMSkip(q_dim=8, num_feats=5, mtsm_norm=True).double().eval()
+    set_backend('optimized')
+    with torch.no_grad():
+        out = layer(x.double(), mask.double())
+        out_old = layer(x.double(), mask_old.float().double())
+    error = max_error([out], [out_old]) + float(mask.dtype != torch.bool)
+    return error, 0.
+
+
+def check_windows(stride):
+    # strided window views against windows copied out of the series
+    series = torch.randn(40, 3, dtype=torch.float64)
+    X = window_view(series, 10, stride)
+    expected = torch.stack([series[i:i + 10] for i in range(0, 31, stride)])
+    expected_re = torch.stack([series[i:i + 6] for i in range(0, len(expected) * stride - stride + 5, stride)])
+    error = (X - expected).abs().max() + (rewindow(X, 6) - expected_re).abs().max()
+    error += (windows_to(X, 'cpu') - expected).abs().max()
+    error += float(X.data_ptr() != series.data_ptr() or rewindow(X, 6).data_ptr() != series.data_ptr())
+    return float(error), 0.
+
+
+def check_window_batches(shuffle, drop_last):
+    # WindowBatches against a DataLoader over the windows: same batches, same global RNG state after
+    series = torch.randn(60, 3, dtype=torch.float64)
+    series[series > 1] = float('nan')
+    X = window_view(series, 8)
+
+    torch.manual_seed(0)
+    batches = [(x.clone(), m.clone()) for x, m in WindowBatches(X, 16, 'cpu', shuffle=shuffle, drop_last=drop_last)]
+    after = torch.rand(1)
+    torch.manual_seed(0)
+    expected = [(torch.nan_to_num(x), ~torch.isnan(x)) for x in DataLoader(X, 16, shuffle=shuffle, drop_last=drop_last)]
+    expected_after = torch.rand(1)
+
+    error = float(len(batches) != len(expected) or (after != expected_after).any())
+    for (x, m), (x_ref, m_ref) in zip(batches, expected):
+        error += float((x - x_ref).abs().max()) + float((m != m_ref).any())
+    return error, 0.
+
+
+def cases():
+    yield 'tfi', check_tfi, {}
+    yield 'data_cache invalidation', check_cache, {}
+    yield 'stream_series scaler', check_stream_scaler, {'chunk_rows': 7}
+    yield 'stream_series scaler', check_stream_scaler, {'chunk_rows': 100}
+    for dtype in ['float32', 'float16', 'bfloat16']:
+        yield 'storage round-trip', check_storage, {'dtype': dtype}
+    yield 'bool masks', check_bool_mask, {}
+    for stride in [1, 3]:
+        yield 'window views', check_windows, {'stride': stride}
+    for shuffle, drop_last in itertools.product([False, True], [False, True]):
+        yield 'WindowBatches vs DataLoader', check_window_batches, {'shuffle': shuffle, 'drop_last': drop_last}
+    yield 'single_query_attention float mask', check_attention, {'bool_mask': False}
+    yield 'single_query_attention bool mask', check_attention, {'bool_mask': True}
+
+    layers = [('MissTSM', MissTSM), ('MissTSMSkip', MissTSMSkip), ('iMissTSM', iMissTSM)]
+    for (name, cls), embed, num_heads, mtsm_norm, layernorm_first in itertools.product(
+            layers, ['tfi', 'linear'], [1, 2], [False, True], [False, True]):
+        kwargs = dict(embed=embed, num_heads=num_heads, mtsm_norm=mtsm_norm, layernorm_first=layernorm_first)
+        if cls is iMissTSM:
+            kwargs['seq_len'] = 12
+        yield name, check_layer, dict(cls=cls, **kwargs)
+
+    for (name, cls), layernorm_first in itertools.product(layers, [False, True]):
+        base = dict(cls=cls, embed='tfi', num_heads=2, mtsm_norm=True, layernorm_first=layernorm_first)
+        if cls is iMissTSM:
+            base['seq_len'] = 12
+        yield name, check_layer, dict(base, layernorm=False)
+        yield name, check_layer, dict(base, observed_only=True)
+        yield name, check_layer, dict(base, chunk_size=5)
+        yield name, check_layer, dict(base, chunk_size=5, use_checkpoint=True)
+        yield name, check_layer, dict(base, num_queries=2)
+        yield name, check_layer, dict(base, num_queries=3, kv_groups=2)
+        yield name, check_layer, dict(base, num_queries=2, kv_groups=1, chunk_size=5)
+
+    for (name, cls), mtsm_norm, layernorm_first in itertools.product(layers, [False, True], [False, True]):
+        kwargs = dict(cls=cls, embed='tfi', num_heads=2, mtsm_norm=mtsm_norm, layernorm_first=layernorm_first)
+        if cls is iMissTSM:
+            kwargs['seq_len'] = 12
+        yield name + ' observed_only vs dense', check_observed_only, kwargs
+
+    for mtsm_norm, observed_only, layernorm_first in itertools.product([False, True], [False, True], [False, True]):
+        yield 'MissTSM.stream', check_stream, dict(mtsm_norm=mtsm_norm, observed_only=observed_only,
+                                                   layernorm_first=layernorm_first)
+    yield 'MissTSM.stream', check_stream, dict(num_heads=2, num_queries=3, kv_groups=1)
+    yield 'MissTSM.stream', check_stream, dict(layernorm=False, layernorm_first=True)
+
+
+def describe(kwargs):
+    return ' '.join('{}={}'.format(k, v) for k, v in kwargs.items() if k != 'cls')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='MissTSM optimized vs. reference backend parity')
+    parser.add_argument('--tol', type=float, default=1e-8, help='max relative error of outputs and gradients')
+    args = parser.parse_args()
+
+    backend = get_backend()
+    failures = 0
+    for name, check, kwargs in cases():
+        out_error, grad_error = check(**kwargs)
+        ok = out_error <= args.tol and grad_error <= args.tol
+        failures += not ok
+        print('{:<5} {:<34} out {:.1e} grad {:.1e}  {}'.format(
+            'ok' if ok else 'FAIL', name, out_error, grad_error, describe(kwargs)))
+    set_backend(backend)
+
+    print('{} failed'.format(failures) if failures else 'all passed')
+    sys.exit(1 if failures else 0)
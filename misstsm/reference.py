@@ -0,0 +1,118 @@
+"""
+Reference backend: the MissTSM layers computed the original straightforward way, one feature
+embedding at a time, a fresh 2D positional encoding per call and nn.MultiheadAttention run on a
+copy of the query per row. Slow, meant for checking the optimized backend (see parity.py)
+"""
+import copy
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from positional_encodings.torch_encodings import PositionalEncoding2D
+
+
+def embed_features(mask_embed, x):
+    """
+    TFI: Linear(1, d) + LayerNorm(d) of every feature in turn, x: [..., N] -> [..., N, d]
+    """
+    if not hasattr(mask_embed, 'norm_weight'):
+        # LinearEmbed, one module shared by every feature
+        return mask_embed.embedding(x.unsqueeze(-1))
+
+    embedded_features = []
+    for i in range(x.shape[-1]):
+        emb = F.linear(x[..., i].unsqueeze(-1), mask_embed.weight[i].unsqueeze(-1), mask_embed.bias[i])
+        emb = F.layer_norm(emb, (emb.shape[-1],), mask_embed.norm_weight[i], mask_embed.norm_bias[i], mask_embed.eps)
+        embedded_features.append(emb)
+    return torch.stack(embedded_features, dim=-2)
+
+
+def positional_encoding(x):
+    """
+    PositionalEncoding2D of x [B, L, N, d], rebuilt on every call
+    """
+    return PositionalEncoding2D(x.shape[-1]).to(x.device)(x)
+
+
+def query_attention(query, x, mhca, key_padding_mask=None):
+    """
+    mhca(query, x, x) with the query [1, 1, d] repeated for every row of x [..., S, d]
+    returns: [..., d]
+    """
+    *rows, seq_len, d = x.shape
+    x = x.reshape(-1, seq_len, d)
+    var_query = query.repeat_interleave(x.shape[0], dim=0)
+    if key_padding_mask is not None:
+        key_padding_mask = copy.deepcopy(key_padding_mask.reshape(-1, seq_len))
+
+    attn_out, _ = mhca(var_query, x, x, key_padding_mask=key_padding_mask)
+
+    return attn_out.reshape(*rows, d)
+
+
+def grouped_query_attention(gqa, query, x, key_padding_mask=None):
+    """
+    GroupedQueryAttention with the keys and values of every group projected and repeated per head
+    query: [1, Q, d], x: [..., S, d], key_padding_mask: [..., S]
+    returns: [..., Q, d]
+    """
+    num_queries = query.shape[-2]
+    num_heads, head_dim = gqa.num_heads, gqa.head_dim
+    group_size = num_heads // gqa.num_kv_groups
+
+    q = gqa.q_proj(query.reshape(num_queries, -1)).view(num_queries, num_heads, head_dim)
+    k, v = gqa.kv_proj(x).chunk(2, dim=-1)
+    k = k.reshape(*k.shape[:-1], gqa.num_kv_groups, head_dim).repeat_interleave(group_size, dim=-2)
+    v = v.reshape(*v.shape[:-1], gqa.num_kv_groups, head_dim).repeat_interleave(group_size, dim=-2)
+
+    scores = torch.einsum('qhc,...shc->...qhs', q, k) * head_dim ** -0.5
+    if key_padding_mask is not None:
+        mask = key_padding_mask.unsqueeze(-2).unsqueeze(-2)
+        if mask.dtype == torch.bool:
+            scores = scores.masked_fill(mask, float('-inf'))
+        else:
+            scores = scores + mask.to(scores.dtype)
+    attn = torch.softmax(scores, dim=-1)
+
+    out = torch.einsum('...qhs,...shc->...qhc', attn, v)
+    return gqa.out_proj(out.reshape(*out.shape[:-2], num_heads * head_dim))
+
+
+def forward(layer, x, m):
+    """
+    Output of a MissTSM, MissTSMSkip or iMissTSM layer for x, m: [B, L, N]. Every timestep is
+    computed and there is no chunking
+    """
+    if layer.mtsm_norm:
+        x, means, std = layer.RevIN(x, m)
+    else:
+        means, std = None, None
+
+    x_inp = x
+    batch_size, window_size, num_feat = x.shape
+    mask = m
+
+    x = embed_features(layer.mask_embed, x)
+    x = x + positional_encoding(x)
+    if layer.layernorm and layer.layernorm_first:
+        x = layer.layernorm(x)
+
+    if layer.layout == 'inverted':
+        x = x.reshape(batch_size, num_feat, window_size, -1)
+        mask = mask.reshape(batch_size, num_feat, window_size)
+
+    if isinstance(layer.mhca, nn.MultiheadAttention):
+        x = query_attention(layer.var_query, x, layer.mhca, key_padding_mask=mask)
+    else:
+        x = grouped_query_attention(layer.mhca, layer.var_query, x, key_padding_mask=mask)
+
+    if layer.layernorm and not layer.layernorm_first:
+        x = layer.layernorm(x)
+    x = layer.projection(x)
+
+    if layer.layout == 'inverted':
+        x = x.permute(0, 2, 1)
+    if layer.layout != 'timestep':
+        x = m*x_inp + (1-m)*x
+
+    return layer.denorm(x, means, std)
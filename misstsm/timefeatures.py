@@ -20,11 +20,48 @@ from pandas.tseries import offsets
 from pandas.tseries.frequencies import to_offset
 
 
+def date_fields(dates):
+    """
+    Integer calendar fields of datetime-like dates, computed with datetime64 arithmetic over the
+    whole array: second, minute, hour, dayofweek (alias weekday, Monday=0), day, dayofyear, month,
+    year and week (ISO week of year). Returns a dict of int64 arrays
+    """
+    t = np.asarray(pd.DatetimeIndex(dates))
+    days = t.astype('datetime64[D]')
+    months = t.astype('datetime64[M]')
+    years = t.astype('datetime64[Y]')
+    seconds = (t - days) // np.timedelta64(1, 's')
+    # 1970-01-01 was a Thursday
+    dayofweek = (days.astype(np.int64) + 3) % 7
+    # the ISO week is the week of the year that holds its Thursday
+    thursday = days - dayofweek + 3
+    week = (thursday - thursday.astype('datetime64[Y]').astype('datetime64[D]')).astype(np.int64) // 7 + 1
+
+    return {
+        'second': seconds % 60,
+        'minute': seconds // 60 % 60,
+        'hour': seconds // 3600,
+        'dayofweek': dayofweek,
+        'weekday': dayofweek,
+        'day': (days - months.astype('datetime64[D]')).astype(np.int64) + 1,
+        'dayofyear': (days - years.astype('datetime64[D]')).astype(np.int64) + 1,
+        'month': months.astype(np.int64) % 12 + 1,
+        'year': years.astype(np.int64) + 1970,
+        'week': week,
+    }
+
+
 class TimeFeature:
+    # the date_fields entry the feature encodes
+    field = None
+
     def __init__(self):
         pass
 
     def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
+        return self.encode(date_fields(index)[self.field])
+
+    def encode(self, values: np.ndarray) -> np.ndarray:
         pass
 
     def __repr__(self):
@@ -33,58 +70,66 @@ class TimeFeature:
 
 class SecondOfMinute(TimeFeature):
     """Minute of hour encoded as value between [-0.5, 0.5]"""
+    field = 'second'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return index.second / 59.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return values / 59.0 - 0.5
 
 
 class MinuteOfHour(TimeFeature):
     """Minute of hour encoded as value between [-0.5, 0.5]"""
+    field = 'minute'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return index.minute / 59.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return values / 59.0 - 0.5
 
 
 class HourOfDay(TimeFeature):
     """Hour of day encoded as value between [-0.5, 0.5]"""
+    field = 'hour'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return index.hour / 23.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return values / 23.0 - 0.5
 
 
 class DayOfWeek(TimeFeature):
     """Hour of day encoded as value between [-0.5, 0.5]"""
+    field = 'dayofweek'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return index.dayofweek / 6.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return values / 6.0 - 0.5
 
 
 class DayOfMonth(TimeFeature):
     """Day of month encoded as value between [-0.5, 0.5]"""
+    field = 'day'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return (index.day - 1) / 30.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return (values - 1) / 30.0 - 0.5
 
 
 class DayOfYear(TimeFeature):
     """Day of year encoded as value between [-0.5, 0.5]"""
+    field = 'dayofyear'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return (index.dayofyear - 1) / 365.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return (values - 1) / 365.0 - 0.5
 
 
 class MonthOfYear(TimeFeature):
     """Month of year encoded as value between [-0.5, 0.5]"""
+    field = 'month'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return (index.month - 1) / 11.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return (values - 1) / 11.0 - 0.5
 
 
 class WeekOfYear(TimeFeature):
     """Week of year encoded as value between [-0.5, 0.5]"""
+    field = 'week'
 
-    def __call__(self, index: pd.DatetimeIndex) -> np.ndarray:
-        return (index.isocalendar().week - 1) / 52.0 - 0.5
+    def encode(self, values: np.ndarray) -> np.ndarray:
+        return (values - 1) / 52.0 - 0.5
 
 
 def time_features_from_frequency_str(freq_str: str) -> List[TimeFeature]:
@@ -145,4 +190,15 @@ def time_features_from_frequency_str(freq_str: str) -> List[TimeFeature]:
 
 
 def time_features(dates, freq='h'):
-    return np.vstack([feat(dates) for feat in time_features_from_frequency_str(freq)])
+    fields = date_fields(dates)
+    return np.vstack([feat.encode(fields[feat.field]) for feat in time_features_from_frequency_str(freq)])
+
+
+def calendar_features(dates, names=('month', 'day', 'weekday', 'hour')):
+    """
+    timeenc=0 encoding: the integer date_fields `names` of the dates as int32 columns, [len(dates), len(names)].
+    As in that encoding, 'minute' is the quarter of the hour (minute // 15)
+    """
+    fields = date_fields(dates)
+    columns = [fields[name] // 15 if name == 'minute' else fields[name] for name in names]
+    return np.stack(columns, axis=1).astype(np.int32)
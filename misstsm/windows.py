@@ -0,0 +1,67 @@
+"""
+Sliding windows of a series as strided views (window_view, rewindow), moved to a device without
+materializing them (windows_to), and batched without a DataLoader (WindowBatches); used by the MAE
+"""
+import math
+
+import torch
+
+
+def window_view(series, window, stride=1):
+    """
+    [T, C] tensor -> [num_windows, window, C] strided view of its windows, nothing is copied
+    """
+    return series.unfold(0, window, stride).transpose(1, 2)
+
+
+def rewindow(X, window):
+    """
+    window_view X -> every window of another length over the same series, also a strided view
+    (with stride > 1 the rows after the last window of X are not seen)
+    """
+    stride = X.stride(0) // X.stride(1)
+    length = (X.shape[0] - 1) * stride + X.shape[1]
+    return X.as_strided(((length - window) // stride + 1, window, X.shape[2]), X.stride(), X.storage_offset())
+
+
+def windows_to(X, device):
+    """
+    window_view X over a copy of its series on device: the windows are not materialized
+    """
+    stride = X.stride(0) // X.stride(1)
+    length = (X.shape[0] - 1) * stride + X.shape[1]
+    series = X.as_strided((length, X.shape[2]), X.stride()[1:], X.storage_offset())
+    return window_view(series.to(device), X.shape[1], stride)
+
+
+class WindowBatches:
+    """
+    batches of a DataLoader over the windows X (the MAEDataset of the MAE) without one: X is kept on
+    device (windows_to) and a batch is gathered with one index, as the zero-filled windows and their
+    observed-value masks
+    """
+    def __init__(self, X, batch_size, device, shuffle=False, drop_last=False):
+        self.X = windows_to(X, device)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.X) // self.batch_size
+        return math.ceil(len(self.X) / self.batch_size)
+
+    def __iter__(self):
+        n = len(self.X)
+        # the global RNG draws of a DataLoader iterator (its base seed, then the seed of its RandomSampler),
+        # so the shuffled batches and the RNG state after an epoch are the DataLoader's
+        torch.empty((), dtype=torch.int64).random_()
+        if self.shuffle:
+            seed = int(torch.empty((), dtype=torch.int64).random_().item())
+            order = torch.randperm(n, generator=torch.Generator().manual_seed(seed))
+        else:
+            order = torch.arange(n)
+        order = order.to(self.X.device)
+        for i in range(len(self)):
+            x = self.X[order[i * self.batch_size:(i + 1) * self.batch_size]]
+            yield torch.nan_to_num(x), ~torch.isnan(x)